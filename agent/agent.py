@@ -2,21 +2,28 @@
 """
 Xray集群管理 - Node Agent
 负责与Master通信，管理本地Xray服务
+
+启动时只导入提供 /health 所需的模块，requests 和本地状态存储在后台线程首次使用时导入，
+注册在后台按退避重试，不阻塞健康检查
 """
 
 import os
 import json
+import gzip
 import hashlib
 import hmac
 import subprocess
 import time
 from datetime import datetime
 from flask import Flask, request, jsonify, make_response
-import requests
 import threading
 import logging
+import random
 import re
 
+from analytics import AccessLogReader, ConnectionTracker, DestinationCounter
+from sync import apply_changes, apply_snapshot, apply_node_config
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -29,6 +36,35 @@ NODE_UUID = os.environ.get('NODE_UUID', '')
 CLUSTER_SECRET = os.environ.get('CLUSTER_SECRET', '')
 MASTER_DOMAIN = os.environ.get('MASTER_DOMAIN', '')
 API_PATH = os.environ.get('API_PATH', '')
+STATE_PATH = os.environ.get('AGENT_STATE_PATH', '/app/data/agent_state.db')
+AGENT_PORT = int(os.environ.get('AGENT_PORT', 8080))
+XRAY_ACCESS_LOG = os.environ.get('XRAY_ACCESS_LOG', '/var/log/xray/access.log')
+XRAY_CONFIG_PATH = '/app/config/config.json'
+
+# 读取访问日志的间隔（秒）
+ACCESS_LOG_INTERVAL = 2
+
+# 每次心跳上报来源IP数最多的用户数
+TOP_USERS = 20
+
+# 每次心跳上报连接数最多的目标域名数
+TOP_DESTINATIONS = 20
+
+# 心跳间隔（秒）
+HEARTBEAT_INTERVAL = 60
+
+# 注册失败后的重试间隔（秒），按指数退避增长
+REGISTER_BACKOFF_MIN = 1
+REGISTER_BACKOFF_MAX = 60
+
+# 与Master通信的超时（连接, 读取），连接超时较短，Master不可达时尽快进入重试
+MASTER_TIMEOUT = (5, 30)
+
+# 增量心跳每隔多少次发送一次完整统计，Master重启丢失上次数据后可据此恢复
+FULL_STATS_INTERVAL = 10
+
+# 每批上报的积压统计条数
+BACKLOG_BATCH_SIZE = 500
 
 # Flask应用
 app = Flask(__name__)
@@ -39,9 +75,33 @@ node_status = {
     'api_secret': None,
     'registered': False,
     'last_heartbeat': None,
-    'xray_status': 'unknown'
+    'xray_status': 'unknown',
+    'config_version': None,
+    'encodings': [],
+    'acked_stats': None,
+    'delta_count': 0,
+    'retry_after': 0,
+    'change_seq': None,
+    'latest_change_seq': None
 }
 
+# 本地状态存储，心跳线程和访问日志线程共用
+state_store = None
+state_store_lock = threading.Lock()
+
+# 与Master通信的HTTP会话
+http_session = None
+
+# 可选的编码库 (msgpack, zstandard)，首次编码时导入
+codecs = None
+
+# 按用户和目标域名统计的连接信息，由访问日志线程写入
+connection_tracker = ConnectionTracker()
+destination_counter = DestinationCounter()
+
+# 命令白名单
+ALLOWED_COMMANDS = frozenset(['docker-compose', 'docker', 'ps', 'restart', 'logs'])
+
 def sanitize_input(input_str, allowed_pattern=r'^[a-zA-Z0-9_\-\.\/]+$'):
     """输入验证和清理"""
     if not input_str:
@@ -62,18 +122,15 @@ def sanitize_input(input_str, allowed_pattern=r'^[a-zA-Z0-9_\-\.\/]+$'):
     
     return input_str
 
-def safe_execute_command(cmd, timeout=30):
-    """安全执行命令，防止命令注入"""
-    # 命令白名单验证
-    allowed_commands = ['docker-compose', 'docker', 'ps', 'restart', 'logs']
-    
+def validate_command(cmd):
+    """校验命令白名单及参数，返回 (是否通过, 参数列表或错误信息)"""
     cmd_parts = cmd.split()
     if not cmd_parts:
         return False, "Empty command"
     
     # 验证基础命令
     base_cmd = cmd_parts[0]
-    if base_cmd not in allowed_commands:
+    if base_cmd not in ALLOWED_COMMANDS:
         return False, f"Command not allowed: {base_cmd}"
     
     # 验证参数
@@ -81,6 +138,14 @@ def safe_execute_command(cmd, timeout=30):
         if not sanitize_input(part):
             return False, f"Invalid parameter: {part}"
     
+    return True, cmd_parts
+
+def safe_execute_command(cmd, timeout=30):
+    """安全执行命令，防止命令注入"""
+    ok, cmd_parts = validate_command(cmd)
+    if not ok:
+        return False, cmd_parts
+    
     try:
         result = subprocess.run(
             cmd_parts,
@@ -134,36 +199,170 @@ def get_xray_status():
         logger.error(f"获取Xray状态失败: {e}")
         return 'error'
 
+def get_system_load():
+    """按CPU核数归一化的1分钟平均负载，供Master分配用户时参考"""
+    try:
+        return round(os.getloadavg()[0] / (os.cpu_count() or 1), 3)
+    except OSError:
+        return None
+
 def get_xray_stats():
-    """获取Xray统计信息"""
-    # 这里可以通过Xray API获取统计信息
-    # 暂时返回模拟数据
+    """获取Xray统计信息
+    
+    connections 为统计窗口内新建的连接数，top_users 为来源IP数最多的用户，用于限制设备数。
+    """
+    connections = connection_tracker.snapshot(TOP_USERS)
     return {
         'uptime': int(time.time()),
-        'connections': 0,
+        'connections': connections['connections'],
+        'active_users': connections['active_users'],
+        'top_users': connections['top_users'],
         'traffic_up': 0,
-        'traffic_down': 0
+        'traffic_down': 0,
+        'load': get_system_load()
     }
 
+def get_master_url(path):
+    """拼接Master API地址"""
+    base_url = MASTER_DOMAIN if "://" in MASTER_DOMAIN else f"https://{MASTER_DOMAIN}"
+    return f"{base_url}{path}"
+
+def get_http_session():
+    """获取与Master通信的HTTP会话，首次使用时导入requests，后续请求复用连接"""
+    global http_session
+    if http_session is None:
+        import requests
+        http_session = requests.Session()
+    return http_session
+
+def get_codecs():
+    """返回本地可用的 (msgpack, zstandard) 模块，未安装的为None"""
+    global codecs
+    if codecs is None:
+        try:
+            import msgpack
+        except ImportError:
+            msgpack = None
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        codecs = (msgpack, zstandard)
+    return codecs
+
+def encode_body(data, compress=False):
+    """按与Master协商的编码序列化请求体，返回 (请求体, 请求头)
+    
+    Master支持时使用msgpack和zstd，否则使用JSON，compress 为True时退回gzip压缩。
+    """
+    msgpack, zstandard = get_codecs()
+    encodings = node_status['encodings']
+    
+    if msgpack is not None and 'msgpack' in encodings:
+        body = msgpack.packb(data)
+        headers = {'Content-Type': 'application/msgpack'}
+    else:
+        body = json.dumps(data, separators=(',', ':')).encode()
+        headers = {'Content-Type': 'application/json'}
+    
+    if zstandard is not None and 'zstd' in encodings:
+        body = zstandard.ZstdCompressor().compress(body)
+        headers['Content-Encoding'] = 'zstd'
+    elif compress:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    
+    return body, headers
+
+def update_encodings(response_data):
+    """记录Master在响应中声明支持的编码"""
+    encodings = response_data.get('encodings')
+    node_status['encodings'] = encodings if isinstance(encodings, list) else []
+
+def diff_stats(stats, previous):
+    """去掉与 previous 相同的统计字段和流量为0的用户，previous 为None时只去掉后者"""
+    result = {
+        key: value for key, value in stats.items()
+        if key != 'users' and (previous is None or previous.get(key) != value)
+    }
+    users = stats.get('users')
+    if users:
+        result['users'] = {
+            name: traffic for name, traffic in users.items()
+            if traffic.get('uplink') or traffic.get('downlink')
+        }
+    return result
+
+def get_state_store():
+    """获取本地状态存储，首次使用时打开"""
+    global state_store
+    with state_store_lock:
+        if state_store is None:
+            from state import StateStore
+            state_store = StateStore(STATE_PATH)
+    return state_store
+
+def load_registration():
+    """从本地状态恢复注册信息，重启后无需重新注册"""
+    node_status['config_version'] = get_state_store().get('config_version')
+    node_status['change_seq'] = get_state_store().get('change_seq')
+    registration = get_state_store().get('registration')
+    if registration and registration.get('token') == NODE_UUID:
+        node_status['node_id'] = registration['node_id']
+        node_status['api_secret'] = registration['api_secret']
+        node_status['registered'] = True
+        logger.info(f"已恢复注册信息，节点ID: {node_status['node_id']}")
+        return True
+    return False
+
+def clear_registration():
+    """Master拒绝认证时清除注册信息，下次循环重新注册"""
+    node_status['registered'] = False
+    node_status['node_id'] = None
+    node_status['api_secret'] = None
+    node_status['acked_stats'] = None
+    node_status['change_seq'] = None
+    get_state_store().delete('registration')
+    get_state_store().delete('change_seq')
+
+def get_retry_after(response):
+    """读取响应的 Retry-After 秒数，缺失或无法解析时返回0"""
+    try:
+        return max(0, int(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        return 0
+
 def register_to_master():
     """向Master注册节点"""
     try:
-        base_url = MASTER_DOMAIN if "://" in MASTER_DOMAIN else f"https://{MASTER_DOMAIN}"
-        url = f"{base_url}/api/node/register"
+        url = get_master_url('/api/node/register')
         data = {
             'token': NODE_UUID,
-            'timestamp': int(time.time())
+            'timestamp': int(time.time()),
+            # Master据此判断本地状态是否重建，决定是否回退统计去重游标
+            'stats_seq': get_state_store().last_stats_seq()
         }
         
-        response = requests.post(url, json=data, timeout=30, verify=True)
+        response = get_http_session().post(url, json=data, timeout=MASTER_TIMEOUT, verify=True)
         
         if response.status_code == 200:
             config = response.json()
+            update_encodings(config)
             node_status['node_id'] = config.get('node_id')
             node_status['api_secret'] = config.get('api_secret')
             node_status['registered'] = True
+            get_state_store().set('registration', {
+                'token': NODE_UUID,
+                'node_id': node_status['node_id'],
+                'api_secret': node_status['api_secret']
+            })
             logger.info(f"成功注册到Master，节点ID: {node_status['node_id']}")
             return True
+        elif response.status_code in (429, 503):
+            # Master限流或过载，按其建议的时间重试
+            node_status['retry_after'] = get_retry_after(response)
+            logger.warning(f"Master繁忙，{node_status['retry_after']} 秒后重试注册")
+            return False
         else:
             logger.error(f"注册失败: {response.status_code} - {response.text}")
             return False
@@ -172,28 +371,104 @@ def register_to_master():
         logger.error(f"注册到Master失败: {e}")
         return False
 
+def build_heartbeat_payload(stats, seq=None):
+    """构造心跳请求体，seq 为统计样本的序号，Master据此去重"""
+    data = {
+        'node_id': node_status['node_id'],
+        'api_secret': node_status['api_secret'],
+        'timestamp': int(time.time()),
+        'config_version': node_status['config_version'],
+        'stats': stats
+    }
+    if seq is not None:
+        data['seq'] = seq
+    return data
+
+def upload_backlog():
+    """分批压缩上报积压的统计样本，全部上报成功时返回True"""
+    store = get_state_store()
+    url = get_master_url('/api/node/stats/batch')
+    
+    while True:
+        samples = store.pending_stats(BACKLOG_BATCH_SIZE)
+        if not samples:
+            return True
+        
+        body, headers = encode_body({
+            'node_id': node_status['node_id'],
+            'api_secret': node_status['api_secret'],
+            'samples': [dict(sample, stats=diff_stats(sample['stats'], None)) for sample in samples]
+        }, compress=True)
+        
+        try:
+            response = get_http_session().post(
+                url,
+                data=body,
+                headers=headers,
+                timeout=MASTER_TIMEOUT,
+                verify=True
+            )
+        except Exception as e:
+            logger.error(f"上报积压统计失败: {e}")
+            return False
+        
+        if response.status_code == 401:
+            clear_registration()
+            return False
+        if response.status_code != 200:
+            logger.error(f"上报积压统计失败: {response.status_code}")
+            return False
+        
+        store.ack_stats(response.json().get('acked_seq', samples[-1]['seq']))
+        logger.info(f"已上报 {len(samples)} 条积压统计")
+
 def send_heartbeat():
-    """发送心跳到Master"""
+    """发送心跳到Master
+    
+    统计样本先写入本地积压，只有唯一的待上报样本随心跳发送；
+    Master不可达期间积累的样本在恢复后按批上报，避免丢失计费数据。
+    Master支持增量心跳时只发送与上次确认时不同的字段，每 FULL_STATS_INTERVAL 次发送一次完整统计。
+    """
     if not node_status['registered']:
         logger.warning("节点未注册，跳过心跳")
         return False
     
+    store = get_state_store()
+    stats = get_xray_stats()
+    stats['top_destinations'] = destination_counter.pop_top(TOP_DESTINATIONS)
+    seq = store.append_stats(stats)
+    
+    if store.pending_count() > 1:
+        if not upload_backlog():
+            return False
+        # 当前样本已随积压上报，心跳仅用于保活
+        seq = None
+    
+    previous = node_status['acked_stats']
+    if 'delta' not in node_status['encodings'] or node_status['delta_count'] >= FULL_STATS_INTERVAL:
+        previous = None
+    
     try:
-        base_url = MASTER_DOMAIN if "://" in MASTER_DOMAIN else f"https://{MASTER_DOMAIN}"
-        url = f"{base_url}/api/node/heartbeat"
-        data = {
-            'node_id': node_status['node_id'],
-            'api_secret': node_status['api_secret'],
-            'timestamp': int(time.time()),
-            'stats': get_xray_stats()
-        }
+        url = get_master_url('/api/node/heartbeat')
+        body, headers = encode_body(build_heartbeat_payload(diff_stats(stats, previous), seq))
         
-        response = requests.post(url, json=data, timeout=30, verify=True)
+        response = get_http_session().post(url, data=body, headers=headers, timeout=MASTER_TIMEOUT, verify=True)
         
         if response.status_code == 200:
+            result = response.json()
             node_status['last_heartbeat'] = datetime.utcnow()
+            node_status['latest_change_seq'] = result.get('change_seq')
+            update_encodings(result)
+            node_status['acked_stats'] = {key: value for key, value in stats.items() if key != 'users'}
+            node_status['delta_count'] = 0 if previous is None else node_status['delta_count'] + 1
+            if seq is not None:
+                store.ack_stats(seq)
             logger.debug("心跳发送成功")
             return True
+        elif response.status_code == 401:
+            logger.error("心跳认证失败，将重新注册")
+            clear_registration()
+            return False
         else:
             logger.error(f"心跳发送失败: {response.status_code}")
             return False
@@ -202,23 +477,134 @@ def send_heartbeat():
         logger.error(f"发送心跳失败: {e}")
         return False
 
+def write_xray_config(config):
+    """先写临时文件再替换，避免Xray读到写了一半的配置"""
+    tmp_path = XRAY_CONFIG_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, XRAY_CONFIG_PATH)
+
+def sync_changes():
+    """从Master增量同步账号变更和节点配置开关并应用到Xray配置，有变化时重启Xray
+
+    每页变更先写入配置再保存序号，中途失败时下次从已保存的序号继续，重复应用不影响结果。
+    本地没有序号（首次同步或重新注册）时Master返回完整快照；重新启用协议后也改为同步完整快照。
+    """
+    store = get_state_store()
+    url = get_master_url('/api/node/changes')
+    modified = False
+    
+    while True:
+        response = get_http_session().post(url, json={
+            'node_id': node_status['node_id'],
+            'api_secret': node_status['api_secret'],
+            'since': node_status['change_seq'] or 0
+        }, timeout=MASTER_TIMEOUT, verify=True)
+        if response.status_code == 401:
+            clear_registration()
+            return False
+        if response.status_code != 200:
+            logger.error(f"同步账号变更失败: {response.status_code}")
+            return False
+        
+        result = response.json()
+        with open(XRAY_CONFIG_PATH) as f:
+            config = json.load(f)
+        
+        previous = store.get('node_config')
+        if result['mode'] == 'snapshot':
+            flags = result.get('config') or previous
+            changed, _ = apply_node_config(config, flags, previous)
+            changed = apply_snapshot(config, result.get('users', []), flags) or changed
+            resync = False
+            logger.info(f"已同步完整账号列表: {len(result.get('users', []))} 个账号")
+        else:
+            changes = result.get('changes', [])
+            flags = next((c.get('data') for c in reversed(changes) if c.get('op') == 'node'), previous)
+            changed, resync = apply_node_config(config, flags, previous)
+            changed = apply_changes(config, changes, flags) or changed
+            if changes:
+                logger.info(f"已同步 {len(changes)} 条账号变更")
+        
+        if changed:
+            write_xray_config(config)
+            modified = True
+        if resync:
+            # 先清除序号再保存开关，中途失败时下次仍会同步完整快照
+            logger.info("有协议重新启用，同步完整账号列表")
+            node_status['change_seq'] = 0
+            store.set('change_seq', 0)
+            store.set('node_config', flags)
+            continue
+        if flags is not None:
+            store.set('node_config', flags)
+        node_status['change_seq'] = result['seq']
+        store.set('change_seq', result['seq'])
+        if result['seq'] >= result.get('latest', result['seq']):
+            break
+    
+    if modified:
+        success, output = safe_execute_command('docker-compose restart xray')
+        if not success:
+            logger.error(f"重启Xray失败: {output}")
+    return True
+
 def heartbeat_loop():
-    """心跳循环线程"""
+    """心跳循环线程
+    
+    注册失败时按指数退避（带随机抖动）重试，Master恢复后尽快完成注册；
+    注册成功后立即发送首次心跳，之后每 HEARTBEAT_INTERVAL 秒一次。
+    """
+    try:
+        load_registration()
+    except Exception as e:
+        logger.error(f"读取本地状态失败: {e}")
+    
+    backoff = REGISTER_BACKOFF_MIN
     while True:
+        delay = HEARTBEAT_INTERVAL
         try:
+            # 更新Xray状态
+            node_status['xray_status'] = get_xray_status()
+            
             if not node_status['registered']:
                 logger.info("尝试注册到Master...")
-                register_to_master()
+                if register_to_master():
+                    backoff = REGISTER_BACKOFF_MIN
+                    delay = 0
+                else:
+                    delay = max(backoff, node_status['retry_after']) + random.uniform(0, backoff / 2)
+                    node_status['retry_after'] = 0
+                    backoff = min(backoff * 2, REGISTER_BACKOFF_MAX)
+                    logger.info(f"{delay:.1f} 秒后重试注册")
             else:
-                send_heartbeat()
-            
-            # 更新Xray状态
-            node_status['xray_status'] = get_xray_status()
+                # Master的变更序号与本地不同时增量同步账号
+                if send_heartbeat() and node_status['latest_change_seq'] is not None \
+                        and node_status['latest_change_seq'] != node_status['change_seq']:
+                    sync_changes()
             
         except Exception as e:
             logger.error(f"心跳循环错误: {e}")
         
-        time.sleep(60)  # 每60秒发送一次心跳
+        time.sleep(delay)
+
+def record_connection(ip, dest, email):
+    """把访问日志中的一条连接计入统计"""
+    connection_tracker.add(email, ip)
+    destination_counter.add(dest)
+
+def access_log_loop():
+    """访问日志读取线程，从上次保存的位置增量读取"""
+    reader = None
+    while True:
+        try:
+            if reader is None:
+                reader = AccessLogReader(XRAY_ACCESS_LOG, get_state_store())
+            reader.read(record_connection)
+        except Exception as e:
+            logger.error(f"读取访问日志失败: {e}")
+        
+        time.sleep(ACCESS_LOG_INTERVAL)
 
 # API路由
 @app.route('/health', methods=['GET'])
@@ -271,9 +657,14 @@ def update_config():
         json.loads(config)
         
         # 保存配置文件
-        with open('/app/config/config.json', 'w') as f:
+        with open(XRAY_CONFIG_PATH, 'w') as f:
             f.write(config)
         
+        # 记录已应用的配置版本，随心跳上报
+        config_version = data.get('version') or hashlib.sha256(config.encode()).hexdigest()[:16]
+        get_state_store().set('config_version', config_version)
+        node_status['config_version'] = config_version
+        
         # 重启Xray应用配置
         success, output = safe_execute_command('docker-compose restart xray')
         
@@ -288,6 +679,60 @@ def update_config():
         logger.error(f"更新配置失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/users/remove', methods=['POST'])
+def remove_users():
+    """从Xray配置中删除到期或超限的账号"""
+    data = request.json
+    if not data:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    
+    signature = request.headers.get('X-Signature')
+    if not signature or not verify_signature(data, signature):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    clients = data.get('clients')
+    if not isinstance(clients, list):
+        return jsonify({'error': 'Missing clients'}), 400
+    
+    emails = {c.get('email') for c in clients if isinstance(c, dict) and c.get('email')}
+    ids = {c.get('id') for c in clients if isinstance(c, dict) and c.get('id')}
+    
+    def matches(client):
+        return (client.get('email') in emails
+                or client.get('id') in ids
+                or client.get('password') in ids)
+    
+    try:
+        with open(XRAY_CONFIG_PATH) as f:
+            config = json.load(f)
+        
+        removed = 0
+        for inbound in config.get('inbounds', []):
+            settings = inbound.get('settings') or {}
+            existing = settings.get('clients')
+            if not isinstance(existing, list):
+                continue
+            kept = [c for c in existing if not (isinstance(c, dict) and matches(c))]
+            removed += len(existing) - len(kept)
+            settings['clients'] = kept
+        
+        if not removed:
+            return jsonify({'status': 'ok', 'removed': 0})
+        
+        write_xray_config(config)
+        
+        logger.info(f"已删除 {removed} 个账号")
+        success, output = safe_execute_command('docker-compose restart xray')
+        
+        if success:
+            return jsonify({'status': 'ok', 'removed': removed})
+        else:
+            return jsonify({'status': 'error', 'message': output}), 500
+            
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"删除账号失败: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/logs', methods=['POST'])
 def get_logs():
     """获取Xray日志"""
@@ -331,9 +776,13 @@ if __name__ == '__main__':
     heartbeat_thread = threading.Thread(target=heartbeat_loop, daemon=True)
     heartbeat_thread.start()
     
+    # 启动访问日志读取线程
+    access_log_thread = threading.Thread(target=access_log_loop, daemon=True)
+    access_log_thread.start()
+    
     logger.info("Node Agent启动")
     logger.info(f"Master域名: {MASTER_DOMAIN}")
     logger.info(f"节点UUID: {NODE_UUID}")
     
     # 运行Flask应用
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    app.run(host='0.0.0.0', port=AGENT_PORT, debug=False)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 连接统计
+按块增量读取Xray访问日志，按用户统计最近窗口内的新建连接数和来源IP数，按目标域名统计连接数。
+来源IP数用HyperLogLog估算，内存占用与连接数无关
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Xray访问日志行，例如:
+# 2024/01/01 12:00:00 1.2.3.4:51234 accepted tcp:www.example.com:443 [vless-in -> direct] email: alice
+# 2024/01/01 12:00:00.123456 from [2001:db8::1]:51234 accepted udp:1.1.1.1:53 [hy2-in >> direct] email: bob
+# 直接在读取的字节块上按行匹配，不逐行解码
+ACCESS_LINE = re.compile(
+    rb'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)? '
+    rb'(?:from )?(?:(?:tcp|udp):)?\[?(?P<ip>[0-9A-Fa-f:.]+?)\]?:\d+ '
+    rb'accepted (?:(?:tcp|udp):)?(?P<dest>[^\s:]+|\[[0-9A-Fa-f:]+\]):\d+ '
+    rb'(?:\[[^\]\n]*\] ?)?email: (?P<email>\S+)',
+    re.MULTILINE
+)
+
+# HyperLogLog寄存器位数，256个寄存器，标准误差约6.5%
+HLL_PRECISION = 8
+
+# 统计窗口（秒），上报的是最近 window~2*window 秒内新建的连接
+CONNECTION_WINDOW = 300
+
+# 跟踪的用户数上限，超出的用户只计入总连接数
+MAX_TRACKED_USERS = 10000
+
+# 跟踪的目标域名数上限，超出时淘汰计数较小的一半
+MAX_TRACKED_DESTINATIONS = 10000
+
+# 每块最多读取的日志字节数，积压较多时分多块读取
+MAX_READ_BYTES = 8 * 1024 * 1024
+
+def iter_access_records(buffer, start=0, end=None):
+    """在 buffer[start:end] 中查找已接受的连接，逐条返回 (来源IP, 目标域名, 用户email)"""
+    for match in ACCESS_LINE.finditer(buffer, start, len(buffer) if end is None else end):
+        ip, dest, email = match.group('ip', 'dest', 'email')
+        yield ip.decode(), dest.decode(), email.decode()
+
+class HyperLogLog:
+    """基数估算，固定 2^precision 字节"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        rest_bits = 64 - self.precision
+        index = x >> rest_bits
+        rank = rest_bits - (x & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """返回与 other 合并后的新实例"""
+        merged = HyperLogLog(self.precision)
+        merged.registers = bytearray(map(max, self.registers, other.registers))
+        return merged
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # 基数较小时使用线性计数修正
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+class ConnectionTracker:
+    """按用户统计最近窗口内的连接
+
+    窗口分为当前和上一段两个桶，统计时合并两个桶。每个桶中每个用户保存一个连接计数
+    和一个HyperLogLog，跟踪的用户数不超过 max_users，内存占用上限约为
+    2 * max_users * 2^precision 字节。
+    """
+
+    def __init__(self, window=CONNECTION_WINDOW, max_users=MAX_TRACKED_USERS,
+                 precision=HLL_PRECISION, clock=time.monotonic):
+        self.window = window
+        self.max_users = max_users
+        self.precision = precision
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._current_total = 0
+        self._previous_total = 0
+        self._started_at = clock()
+
+    def _rotate(self):
+        elapsed = self.clock() - self._started_at
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self._previous, self._previous_total = self._current, self._current_total
+        else:
+            self._previous, self._previous_total = {}, 0
+        self._current, self._current_total = {}, 0
+        self._started_at = self.clock()
+
+    def add(self, email, ip):
+        """记录一个新建连接"""
+        with self._lock:
+            self._rotate()
+            self._current_total += 1
+            entry = self._current.get(email)
+            if entry is None:
+                if len(self._current) >= self.max_users:
+                    return
+                entry = self._current[email] = [0, HyperLogLog(self.precision)]
+            entry[0] += 1
+            entry[1].add(ip)
+
+    def snapshot(self, top_k=20):
+        """返回窗口内的总连接数、活跃用户数及来源IP数最多的 top_k 个用户"""
+        with self._lock:
+            self._rotate()
+            merged = {email: (entry[0], entry[1]) for email, entry in self._previous.items()}
+            for email, (connections, ips) in self._current.items():
+                if email in merged:
+                    previous_connections, previous_ips = merged[email]
+                    merged[email] = (previous_connections + connections, previous_ips.merge(ips))
+                else:
+                    merged[email] = (connections, ips)
+            total = self._previous_total + self._current_total
+
+        users = [
+            {'email': email, 'connections': connections, 'ips': ips.count()}
+            for email, (connections, ips) in merged.items()
+        ]
+        return {
+            'connections': total,
+            'active_users': len(users),
+            'top_users': heapq.nlargest(top_k, users, key=lambda u: (u['ips'], u['connections'])),
+        }
+
+class DestinationCounter:
+    """按目标域名统计上次上报以来的连接数，跟踪的域名数不超过 max_destinations"""
+
+    def __init__(self, max_destinations=MAX_TRACKED_DESTINATIONS):
+        self.max_destinations = max_destinations
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def add(self, dest):
+        with self._lock:
+            self._counts[dest] = self._counts.get(dest, 0) + 1
+            if len(self._counts) > self.max_destinations:
+                keep = heapq.nlargest(self.max_destinations // 2, self._counts.items(), key=lambda item: item[1])
+                self._counts = dict(keep)
+
+    def pop_top(self, top_k=20):
+        """返回连接数最多的 top_k 个域名并清零"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return [
+            {'host': host, 'connections': count}
+            for host, count in heapq.nlargest(top_k, counts.items(), key=lambda item: item[1])
+        ]
+
+class AccessLogReader:
+    """按块增量读取访问日志
+
+    读取位置（文件inode和字节偏移）保存在本地状态存储中，Agent重启后从上次的位置继续，
+    不重复读取也不遗漏。文件被改名轮转后先读完旧文件剩余内容再从头读取新文件；
+    被截断（copytruncate）时从头读取。首次运行时从文件末尾开始。
+    用有界的read()而不是mmap，读取中途文件被截断时不会因访问失效的映射页触发SIGBUS。
+    """
+
+    def __init__(self, path, state_store=None, state_key='access_log_position'):
+        self.path = path
+        self.state_store = state_store
+        self.state_key = state_key
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._saved = None
+
+    def _save_position(self):
+        position = {'inode': self._inode, 'offset': self._offset}
+        if self.state_store is not None and position != self._saved:
+            self.state_store.set(self.state_key, position)
+            self._saved = position
+
+    def _open(self, saved=None, from_start=False):
+        """打开日志文件，saved 为保存的读取位置，为None时从末尾开始"""
+        self._file = open(self.path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        if from_start:
+            self._offset = 0
+        elif saved is None:
+            self._offset = stat.st_size
+        elif saved.get('inode') == stat.st_ino and saved.get('offset', 0) <= stat.st_size:
+            self._offset = saved['offset']
+        else:
+            self._offset = 0
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def _read_open_file(self, handle):
+        """读取当前文件中新增的完整行，返回处理的记录数"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._offset:
+            # 文件被截断
+            self._offset = 0
+        if size == self._offset:
+            return 0
+
+        records = 0
+        while self._offset < size:
+            self._file.seek(self._offset)
+            chunk = self._file.read(min(size - self._offset, MAX_READ_BYTES))
+            # 只处理到最后一个换行符，未写完的行留到下次；中途被截断时读到的内容变少，下次从头读取
+            end = chunk.rfind(b'\n') + 1
+            if end == 0:
+                break
+            for record in iter_access_records(chunk, 0, end):
+                handle(*record)
+                records += 1
+            self._offset += end
+        return records
+
+    def read(self, handle):
+        """处理新增的日志行，每条已接受的连接调用 handle(来源IP, 目标域名, 用户email)，返回记录数"""
+        records = 0
+        try:
+            if self._file is None:
+                saved = self.state_store.get(self.state_key) if self.state_store is not None else None
+                self._saved = saved
+                self._open(saved)
+
+            try:
+                current_inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current_inode = None
+
+            if current_inode != self._inode:
+                # 已轮转，读完旧文件剩余内容后切换到新文件
+                records += self._read_open_file(handle)
+                self._close()
+                if current_inode is None:
+                    return records
+                self._open(from_start=True)
+            records += self._read_open_file(handle)
+        except OSError as e:
+            self._close()
+            logger.debug(f"无法读取访问日志: {e}")
+        finally:
+            if self._file is not None:
+                self._save_position()
+        return records
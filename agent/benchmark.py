@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - Agent热点函数微基准测试
+覆盖签名校验、输入验证、心跳序列化与配置解析，以及Agent冷启动耗时，结果按次保存并与历史基线比较
+
+用法:
+    python benchmark.py                  # 运行并与上次保存的结果比较
+    python benchmark.py --save           # 运行并保存为新的基线
+    python benchmark.py -k signature     # 只运行名称包含 signature 的用例
+    python benchmark.py -k startup       # 只测量启动耗时
+    python benchmark.py --scale 2        # 按2倍放宽阈值（默认按校准结果自动放宽）
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import socket
+import statistics
+import subprocess
+import tempfile
+import logging
+import urllib.request
+from datetime import datetime
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AGENT_DIR)
+
+import agent  # noqa: E402
+
+# 结果存储
+DEFAULT_STORAGE = os.path.join(AGENT_DIR, '.benchmarks', 'history.json')
+HISTORY_LIMIT = 50
+
+# 相对上次基线允许的中位数退化比例
+DEFAULT_MAX_REGRESSION = 0.20
+
+# 各用例中位数耗时上限（毫秒），以1核小规格VPS为参考，运行时按本机速度放大
+THRESHOLDS_MS = {
+    'verify_signature_1mb': 40.0,
+    'sanitize_input_valid': 0.02,
+    'sanitize_input_traversal': 0.05,
+    'validate_command': 0.05,
+    'heartbeat_payload_10k_users': 30.0,
+    'heartbeat_compact_10k_users': 30.0,
+    'config_json_loads_4mb': 80.0,
+    'access_log_ingest_100k_lines': 1200.0,
+    'startup_import': 400.0,
+    'startup_health_ready': 1500.0,
+}
+
+# 校准负载在参考VPS上的最短耗时（毫秒），本机更慢时阈值按比例放大，更快时不收紧
+CALIBRATION_REFERENCE_MS = 60.0
+
+# 启动用例每轮都要启动新进程，轮数不超过该值
+STARTUP_ROUNDS = 5
+
+# 等待 /health 可用的最长时间（秒）
+STARTUP_TIMEOUT = 30
+
+# 颜色定义
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    END = '\033[0m'
+
+def print_pass(msg):
+    print(f"{Colors.GREEN}✓ PASS:{Colors.END} {msg}")
+
+def print_fail(msg):
+    print(f"{Colors.RED}✗ FAIL:{Colors.END} {msg}")
+
+def print_warn(msg):
+    print(f"{Colors.YELLOW}⚠ WARN:{Colors.END} {msg}")
+
+# 测试数据
+def make_large_payload(size_bytes):
+    """构造指定大小左右的签名请求体"""
+    chunk = 'x' * 1024
+    return {
+        'action': 'update',
+        'items': [f"{i}-{chunk}" for i in range(size_bytes // 1024)],
+    }
+
+def make_user_stats(user_count):
+    """构造带每用户流量计数的统计信息"""
+    stats = agent.get_xray_stats()
+    stats['users'] = {
+        f"user{i}@example.com": {'uplink': i * 1024, 'downlink': i * 4096}
+        for i in range(user_count)
+    }
+    return stats
+
+def make_xray_config(size_bytes):
+    """构造指定大小左右的Xray配置"""
+    clients = []
+    current = 0
+    i = 0
+    while current < size_bytes:
+        client = {
+            'id': f"00000000-0000-4000-8000-{i:012d}",
+            'email': f"user{i}@example.com",
+            'flow': 'xtls-rprx-vision',
+        }
+        current += len(json.dumps(client))
+        clients.append(client)
+        i += 1
+    return json.dumps({
+        'log': {'loglevel': 'warning'},
+        'inbounds': [{'port': 443, 'protocol': 'vless', 'settings': {'clients': clients, 'decryption': 'none'}}],
+        'outbounds': [{'protocol': 'freedom', 'tag': 'direct'}],
+    })
+
+def make_access_log(line_count, user_count=1000):
+    """构造Xray访问日志行"""
+    return [
+        f"2024/01/01 12:00:00 10.{i % 7}.{i % 251}.{i % 13}:{40000 + i % 20000} "
+        f"accepted tcp:www.example{i % 50}.com:443 [vless-in -> direct] email: user{i % user_count}@example.com\n"
+        for i in range(line_count)
+    ]
+
+class MemoryStateStore(dict):
+    """只保存在内存中的状态存储，用于从指定位置读取访问日志"""
+
+    def set(self, key, value):
+        self[key] = value
+
+def ingest_access_log(path):
+    """从头增量读取访问日志文件，计入连接和目标域名统计"""
+    store = MemoryStateStore(access_log_position={'inode': os.stat(path).st_ino, 'offset': 0})
+    tracker = agent.ConnectionTracker()
+    destinations = agent.DestinationCounter()
+
+    def handle(ip, dest, email):
+        tracker.add(email, ip)
+        destinations.add(dest)
+
+    agent.AccessLogReader(path, store).read(handle)
+    return tracker.snapshot(agent.TOP_USERS), destinations.pop_top(agent.TOP_DESTINATIONS)
+
+def calibration_workload():
+    """固定的纯Python负载（字符串格式化和字典更新），与被测热点函数的开销构成相近"""
+    counts = {}
+    total = 0
+    for i in range(200000):
+        key = f"user{i % 1000}"
+        counts[key] = counts.get(key, 0) + i
+        total += len(key)
+    return total
+
+def calibrate(rounds=7):
+    """返回阈值放大倍数：本机运行校准负载的最短耗时与参考VPS之比，不小于1"""
+    calibration_workload()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        calibration_workload()
+        samples.append((time.perf_counter() - start) * 1000)
+    return max(1.0, min(samples) / CALIBRATION_REFERENCE_MS)
+
+# 基准用例
+def bench_cases(work_dir):
+    """返回 (名称, 被测函数, 每轮调用次数) 列表，临时文件写入 work_dir"""
+    agent.node_status['api_secret'] = 'b' * 64
+    agent.node_status['encodings'] = ['msgpack', 'zstd', 'delta']
+    payload = make_large_payload(1024 * 1024)
+    signature = agent.hmac.new(
+        agent.node_status['api_secret'].encode(),
+        json.dumps(payload, sort_keys=True).encode(),
+        agent.hashlib.sha256
+    ).hexdigest()
+
+    stats = make_user_stats(10000)
+    config = make_xray_config(4 * 1024 * 1024)
+    access_log = os.path.join(work_dir, 'access.log')
+    with open(access_log, 'w') as f:
+        f.writelines(make_access_log(100000))
+
+    return [
+        ('verify_signature_1mb', lambda: agent.verify_signature(payload, signature), 1),
+        ('sanitize_input_valid', lambda: agent.sanitize_input('xray-node-xray'), 1000),
+        ('sanitize_input_traversal', lambda: agent.sanitize_input('../../etc/passwd'), 1000),
+        ('validate_command', lambda: agent.validate_command('docker logs --tail 100 xray-node-xray'), 1000),
+        ('heartbeat_payload_10k_users', lambda: json.dumps(agent.build_heartbeat_payload(stats)), 1),
+        ('heartbeat_compact_10k_users', lambda: agent.encode_body(agent.build_heartbeat_payload(stats)), 1),
+        ('config_json_loads_4mb', lambda: json.loads(config), 1),
+        ('access_log_ingest_100k_lines', lambda: ingest_access_log(access_log), 1),
+    ]
+
+# 启动耗时用例
+def startup_env(state_dir):
+    """启动Agent子进程的环境变量，Master地址不可达，模拟Master故障时的冷启动"""
+    env = dict(os.environ)
+    env.update({
+        'MASTER_DOMAIN': 'http://127.0.0.1:9',
+        'NODE_UUID': 'benchmark',
+        'AGENT_STATE_PATH': os.path.join(state_dir, 'agent_state.db'),
+    })
+    return env
+
+def free_port():
+    """获取一个空闲的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_until_healthy(env):
+    """启动Agent进程并轮询直到 /health 返回200"""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, 'agent.py'],
+        cwd=AGENT_DIR,
+        env=dict(env, AGENT_PORT=str(port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Agent进程退出，返回码 {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('等待 /health 超时')
+                time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def startup_cases(work_dir):
+    """返回 (名称, 被测函数) 列表，每次调用启动一个新的Python进程，状态文件写入 work_dir"""
+    env = startup_env(work_dir)
+    return [
+        ('startup_import', lambda: subprocess.run(
+            [sys.executable, '-c', 'import agent'], cwd=AGENT_DIR, env=env, check=True
+        )),
+        ('startup_health_ready', lambda: start_until_healthy(env)),
+    ]
+
+def run_case(func, inner, rounds, warmup):
+    """多轮计时，返回单次调用耗时（毫秒）统计"""
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        samples.append((time.perf_counter() - start) * 1000 / inner)
+
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'stddev': statistics.pstdev(samples),
+        'rounds': rounds,
+    }
+
+# 结果存储
+def load_history(path):
+    """读取历史结果"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print_warn(f"读取历史结果失败: {e}")
+        return []
+
+def save_history(path, history):
+    """保存历史结果，只保留最近 HISTORY_LIMIT 次"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(history[-HISTORY_LIMIT:], f, indent=2)
+    os.replace(tmp_path, path)
+
+def check_results(results, baseline, max_regression, scale=1.0):
+    """检查绝对阈值（按 scale 放大）及相对基线的退化，返回是否全部通过"""
+    all_passed = True
+    for name, result in results.items():
+        median = result['median']
+        limit = THRESHOLDS_MS.get(name)
+        line = f"{name}: median {median:.4f} ms"
+
+        if limit is not None and median > limit * scale:
+            print_fail(f"{line} 超过阈值 {limit * scale:.4g} ms")
+            all_passed = False
+            continue
+
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = (median - previous['median']) / previous['median']
+            line += f" ({change:+.1%} vs 基线)"
+            if change > max_regression:
+                print_fail(f"{line} 退化超过 {max_regression:.0%}")
+                all_passed = False
+                continue
+
+        print_pass(line)
+
+    return all_passed
+
+def main():
+    """运行基准测试"""
+    parser = argparse.ArgumentParser(description='Agent热点函数微基准测试')
+    parser.add_argument('-k', dest='keyword', help='只运行名称包含该关键字的用例')
+    parser.add_argument('--rounds', type=int, default=20, help='每个用例的计时轮数')
+    parser.add_argument('--warmup', type=int, default=3, help='预热次数')
+    parser.add_argument('--storage', default=os.environ.get('AGENT_BENCH_FILE', DEFAULT_STORAGE),
+                        help='历史结果文件路径')
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help='相对基线允许的退化比例，例如 0.2 表示 20%%')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='阈值放大倍数，默认按校准负载相对参考VPS的耗时自动计算')
+    parser.add_argument('--save', action='store_true', help='将本次结果保存为新的基线')
+    args = parser.parse_args()
+
+    # 避免验证失败的告警日志干扰计时
+    agent.logger.setLevel(logging.ERROR)
+
+    print(f"\n{Colors.BLUE}{'='*60}{Colors.END}")
+    print(f"{Colors.BLUE}Agent微基准测试{Colors.END}")
+    print(f"{Colors.BLUE}{'='*60}{Colors.END}\n")
+
+    scale = args.scale if args.scale is not None else calibrate()
+    print(f"阈值放大倍数: {scale:.2f}\n")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='agent-bench-') as work_dir:
+        for name, func, inner in bench_cases(work_dir):
+            if args.keyword and args.keyword not in name:
+                continue
+            results[name] = run_case(func, inner, args.rounds, args.warmup)
+        for name, func in startup_cases(work_dir):
+            if args.keyword and args.keyword not in name:
+                continue
+            results[name] = run_case(func, 1, min(args.rounds, STARTUP_ROUNDS), 1)
+
+    history = load_history(args.storage)
+    baseline = history[-1]['results'] if history else None
+    if baseline is None:
+        print_warn("没有历史基线，仅检查绝对阈值")
+
+    passed = check_results(results, baseline, args.max_regression, scale)
+
+    if args.save:
+        history.append({
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': sys.version.split()[0],
+            'scale': scale,
+            'results': results,
+        })
+        save_history(args.storage, history)
+        print(f"\n结果已保存: {args.storage}")
+
+    return 0 if passed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
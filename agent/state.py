@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - Node Agent本地状态存储
+持久化注册信息、已应用的配置版本和尚未上报的统计数据，Master不可达或Agent重启时不丢失
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 积压统计的最大条数，按60秒心跳约为一个月
+MAX_BACKLOG = 50000
+
+class StateStore:
+    """基于SQLite的本地状态存储
+
+    kv 表保存注册信息等键值，stats_backlog 表按序号保存待上报的统计样本，
+    序号同时用于Master端去重，重复上报不会重复计费。
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS stats_backlog ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER NOT NULL, stats TEXT NOT NULL)'
+        )
+
+    # 键值
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO kv (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, json.dumps(value))
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    # 统计积压
+    def append_stats(self, stats, timestamp=None):
+        """保存一条统计样本，返回其序号"""
+        timestamp = int(timestamp or time.time())
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO stats_backlog (timestamp, stats) VALUES (?, ?)',
+                (timestamp, json.dumps(stats, separators=(',', ':')))
+            )
+            seq = cursor.lastrowid
+            overflow = self._conn.execute('SELECT COUNT(*) FROM stats_backlog').fetchone()[0] - MAX_BACKLOG
+            if overflow > 0:
+                logger.error(f"统计积压超过上限，丢弃最早的 {overflow} 条")
+                self._conn.execute(
+                    'DELETE FROM stats_backlog WHERE seq IN '
+                    '(SELECT seq FROM stats_backlog ORDER BY seq LIMIT ?)',
+                    (overflow,)
+                )
+        return seq
+
+    def last_stats_seq(self):
+        """已分配的最大统计序号，删除已确认的样本后也不回退，本地状态新建时为0"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'stats_backlog'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM stats_backlog').fetchone()[0]
+
+    def pending_stats(self, limit):
+        """按序号顺序读取最早的待上报样本"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, timestamp, stats FROM stats_backlog ORDER BY seq LIMIT ?',
+                (limit,)
+            ).fetchall()
+        return [{'seq': seq, 'timestamp': timestamp, 'stats': json.loads(stats)} for seq, timestamp, stats in rows]
+
+    def ack_stats(self, up_to_seq):
+        """删除已被Master确认的样本"""
+        with self._lock:
+            self._conn.execute('DELETE FROM stats_backlog WHERE seq <= ?', (up_to_seq,))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 账号增量同步
+把Master变更日志中的账号变更和节点配置开关应用到Xray配置。由Master管理的账号以 email 标识，
+没有 email 的账号（如安装时生成的默认账号）不受同步影响
+"""
+
+# 使用UUID标识账号的协议，其他协议（trojan、shadowsocks等）使用密码
+UUID_PROTOCOLS = ('vless', 'vmess')
+
+# 对应 enable_splithttp 开关的VLESS传输方式，其他传输方式的VLESS入站对应 enable_vless
+SPLITHTTP_NETWORKS = ('splithttp', 'xhttp')
+
+# 对应 enable_hysteria2 开关的入站协议
+HYSTERIA_PROTOCOLS = ('hysteria', 'hysteria2')
+
+def inbound_feature(inbound):
+    """入站对应的节点配置开关名，与开关无关的入站返回None"""
+    protocol = inbound.get('protocol')
+    if protocol in HYSTERIA_PROTOCOLS:
+        return 'enable_hysteria2'
+    if protocol == 'vless':
+        network = (inbound.get('streamSettings') or {}).get('network')
+        return 'enable_splithttp' if network in SPLITHTTP_NETWORKS else 'enable_vless'
+    return None
+
+def _is_enabled(feature, flags):
+    return feature is None or not flags or flags.get(feature) is not False
+
+def _client_for(inbound, user, template):
+    """按入站协议构造客户端条目，flow 等附加字段沿用入站中已有的客户端"""
+    if inbound.get('protocol') in UUID_PROTOCOLS:
+        client = {'id': user['id'], 'email': user['email']}
+        if template.get('flow'):
+            client['flow'] = template['flow']
+    else:
+        client = {'password': user['id'], 'email': user['email']}
+    return client
+
+def _client_inbounds(config, flags=None):
+    """返回带客户端列表的入站，flags 为节点配置开关，跳过已停用协议的入站"""
+    for inbound in config.get('inbounds', []):
+        settings = inbound.get('settings') or {}
+        if isinstance(settings.get('clients'), list) and _is_enabled(inbound_feature(inbound), flags):
+            yield inbound, settings
+
+def apply_node_config(config, flags, previous=None):
+    """按节点配置开关启用或停用协议，返回 (配置是否被修改, 是否需要完整快照)
+
+    停用的协议清空入站中由Master管理的账号，入站本身（及其回落）和没有 email 的账号保留；
+    重新启用的协议入站中没有账号，需要同步完整快照补齐。previous 为上次应用的开关。
+    """
+    if not flags:
+        return False, False
+    modified = False
+    resync = False
+    for inbound in config.get('inbounds', []):
+        settings = inbound.get('settings') or {}
+        feature = inbound_feature(inbound)
+        if feature is None or not isinstance(settings.get('clients'), list):
+            continue
+        if not _is_enabled(feature, flags):
+            clients = settings['clients']
+            unmanaged = [c for c in clients if not (isinstance(c, dict) and c.get('email'))]
+            if unmanaged != clients:
+                settings['clients'] = unmanaged
+                modified = True
+        elif previous and not _is_enabled(feature, previous):
+            resync = True
+    return modified, resync
+
+def apply_changes(config, changes, flags=None):
+    """应用 upsert/remove 变更，返回配置是否被修改"""
+    modified = False
+    for inbound, settings in _client_inbounds(config, flags):
+        clients = settings['clients']
+        template = next((c for c in clients if isinstance(c, dict)), {})
+        unmanaged = [c for c in clients if not (isinstance(c, dict) and c.get('email'))]
+        managed = {c['email']: c for c in clients if isinstance(c, dict) and c.get('email')}
+        changed = False
+        for change in changes:
+            user = change.get('data') or {}
+            email = user.get('email')
+            if not email:
+                continue
+            if change.get('op') == 'upsert':
+                client = _client_for(inbound, user, template)
+                if managed.get(email) != client:
+                    managed[email] = client
+                    changed = True
+            elif change.get('op') == 'remove' and email in managed:
+                del managed[email]
+                changed = True
+        if changed:
+            settings['clients'] = unmanaged + list(managed.values())
+            modified = True
+    return modified
+
+def apply_snapshot(config, users, flags=None):
+    """用完整账号列表替换Master管理的账号，返回配置是否被修改"""
+    modified = False
+    for inbound, settings in _client_inbounds(config, flags):
+        clients = settings['clients']
+        template = next((c for c in clients if isinstance(c, dict)), {})
+        unmanaged = [c for c in clients if not (isinstance(c, dict) and c.get('email'))]
+        replaced = unmanaged + [_client_for(inbound, user, template) for user in users]
+        if replaced != clients:
+            settings['clients'] = replaced
+            modified = True
+    return modified
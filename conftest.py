@@ -0,0 +1,45 @@
+"""
+测试公共夹具：Master应用使用临时SQLite数据库和进程内状态（不连接Redis）
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for directory in ('web', 'agent'):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """导入Master应用；环境变量只在导入期间修改，结束后恢复"""
+    pytest.importorskip('flask_sqlalchemy')
+    db_path = tmp_path_factory.mktemp('db') / 'test.db'
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATABASE_URL', f'sqlite:///{db_path}')
+        mp.delenv('REDIS_URL', raising=False)
+        mp.delenv('DATABASE_REPLICA_URLS', raising=False)
+        import app as module
+    module.app.config['TESTING'] = True
+    return module
+
+@pytest.fixture
+def app_ctx(app_module, monkeypatch):
+    """每个测试使用空表和干净的进程内缓存"""
+    monkeypatch.setattr(app_module, 'fragment_cache', app_module.FragmentCache())
+    monkeypatch.setattr(app_module, 'subscription_cache', app_module.SubscriptionCache())
+    monkeypatch.setattr(app_module, 'rate_limiter', app_module.RateLimiter())
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        yield app_module
+        app_module.db.session.remove()
+
+@pytest.fixture
+def admin_client(app_ctx, monkeypatch):
+    """跳过登录的管理端测试客户端"""
+    monkeypatch.setitem(app_ctx.app.config, 'LOGIN_DISABLED', True)
+    return app_ctx.app.test_client()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 访问日志增量读取单元测试
+"""
+
+import os
+
+from analytics import AccessLogReader
+
+class MemoryStateStore(dict):
+    def set(self, key, value):
+        self[key] = value
+
+def log_line(i):
+    return (f"2024/01/01 12:00:00 10.0.0.{i}:40000 accepted tcp:www.example{i}.com:443 "
+            f"[vless-in -> direct] email: user{i}@example.com\n")
+
+def append(path, *indexes):
+    with open(path, 'a') as f:
+        f.writelines(log_line(i) for i in indexes)
+
+def read_emails(reader):
+    emails = []
+    reader.read(lambda ip, dest, email: emails.append(email))
+    return emails
+
+def test_first_read_starts_at_end_of_file(tmp_path):
+    path = str(tmp_path / 'access.log')
+    append(path, 1, 2)
+    reader = AccessLogReader(path, MemoryStateStore())
+    assert read_emails(reader) == []
+    append(path, 3)
+    assert read_emails(reader) == ['user3@example.com']
+
+def test_partial_line_is_read_once_complete(tmp_path):
+    path = str(tmp_path / 'access.log')
+    append(path)
+    reader = AccessLogReader(path, MemoryStateStore())
+    read_emails(reader)
+    line = log_line(1)
+    with open(path, 'a') as f:
+        f.write(line[:20])
+    assert read_emails(reader) == []
+    with open(path, 'a') as f:
+        f.write(line[20:])
+    assert read_emails(reader) == ['user1@example.com']
+
+def test_rename_rotation_drains_old_file_then_reads_new(tmp_path):
+    path = str(tmp_path / 'access.log')
+    append(path)
+    reader = AccessLogReader(path, MemoryStateStore())
+    read_emails(reader)
+    append(path, 1)
+    os.rename(path, path + '.1')
+    append(path, 2)
+    assert read_emails(reader) == ['user1@example.com', 'user2@example.com']
+    append(path, 3)
+    assert read_emails(reader) == ['user3@example.com']
+
+def test_copytruncate_rotation_reads_from_start(tmp_path):
+    path = str(tmp_path / 'access.log')
+    append(path, 1, 2, 3)
+    reader = AccessLogReader(path, MemoryStateStore())
+    read_emails(reader)
+    with open(path, 'w'):
+        pass
+    append(path, 4)
+    assert read_emails(reader) == ['user4@example.com']
+
+def test_backlog_larger_than_one_chunk_is_read_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr('analytics.MAX_READ_BYTES', len(log_line(1)) * 3 // 2)
+    path = str(tmp_path / 'access.log')
+    append(path)
+    reader = AccessLogReader(path, MemoryStateStore())
+    read_emails(reader)
+    append(path, *range(1, 6))
+    assert read_emails(reader) == [f'user{i}@example.com' for i in range(1, 6)]
+
+def test_truncation_during_read_is_not_fatal(tmp_path, monkeypatch):
+    monkeypatch.setattr('analytics.MAX_READ_BYTES', len(log_line(1)))
+    path = str(tmp_path / 'access.log')
+    append(path)
+    reader = AccessLogReader(path, MemoryStateStore())
+    read_emails(reader)
+    append(path, 1, 2)
+
+    def truncate_after_first(ip, dest, email):
+        emails.append(email)
+        with open(path, 'w'):
+            pass
+
+    emails = []
+    reader.read(truncate_after_first)
+    assert emails[0] == 'user1@example.com'
+    append(path, 3)
+    assert read_emails(reader) == ['user3@example.com']
+
+def test_restart_resumes_from_saved_position(tmp_path):
+    path = str(tmp_path / 'access.log')
+    store = MemoryStateStore()
+    append(path)
+    reader = AccessLogReader(path, store)
+    read_emails(reader)
+    append(path, 1)
+    assert read_emails(reader) == ['user1@example.com']
+    append(path, 2)
+    # 新的读取器（Agent重启）从保存的位置继续，不重复也不遗漏
+    assert read_emails(AccessLogReader(path, store)) == ['user2@example.com']
+
+def test_missing_file_is_not_an_error(tmp_path):
+    reader = AccessLogReader(str(tmp_path / 'missing.log'), MemoryStateStore())
+    assert read_emails(reader) == []
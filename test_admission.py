@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 并发准入控制单元测试
+"""
+
+import pytest
+
+from ratelimit import ConcurrencyLimiter
+
+@pytest.fixture
+def full_admission(app_ctx, monkeypatch):
+    """并发许可已全部被占用"""
+    limiter = ConcurrencyLimiter(limit=1)
+    assert limiter.acquire()
+    monkeypatch.setattr(app_ctx, 'admission', limiter)
+    return limiter
+
+@pytest.fixture
+def subscription_url(app_ctx):
+    db = app_ctx.db
+    node = app_ctx.Node(name='n1', server_ip='127.0.0.1', token='t1', api_secret='s', enable_vless=True)
+    db.session.add(node)
+    db.session.commit()
+    user = app_ctx.UserAccount(username='alice', password='uuid-a', node_id=node.id)
+    db.session.add(user)
+    db.session.commit()
+    return f"/sub/{app_ctx.get_subscription_token(user)}"
+
+def test_cached_subscription_skips_admission(app_ctx, subscription_url, monkeypatch):
+    client = app_ctx.app.test_client()
+    assert client.get(subscription_url).status_code == 200
+
+    limiter = ConcurrencyLimiter(limit=1)
+    limiter.acquire()
+    monkeypatch.setattr(app_ctx, 'admission', limiter)
+    assert client.get(subscription_url).status_code == 200
+    assert client.get('/static/missing.css').status_code == 404
+
+def test_subscription_cache_miss_needs_admission(app_ctx, subscription_url, full_admission):
+    response = app_ctx.app.test_client().get(subscription_url)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_database_routes_need_admission(app_ctx, full_admission):
+    client = app_ctx.app.test_client()
+    assert client.post('/api/node/register', json={'token': 'x'}).status_code == 503
+    full_admission.release(True)
+    assert client.post('/api/node/register', json={'token': 'x'}).status_code == 401
+    # 请求结束后许可已释放
+    assert full_admission.acquire()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 用户批量导入、导出和修改单元测试
+"""
+
+import json
+
+import pytest
+
+@pytest.fixture
+def users(app_ctx):
+    db = app_ctx.db
+    node = app_ctx.Node(name='n1', server_ip='127.0.0.1', token='bulk-token', api_secret='s')
+    db.session.add(node)
+    db.session.commit()
+    for i in range(1, 13):
+        db.session.add(app_ctx.UserAccount(username=f'user{i}', password=f'uuid-{i}',
+                                           node_id=node.id if i % 2 else None, enabled=i != 3))
+    db.session.commit()
+    return node
+
+def exported_ids(client, query):
+    response = client.get(f'/api/users/export?format=json&{query}')
+    assert response.status_code == 200
+    return [user['id'] for user in json.loads(response.get_data(as_text=True))]
+
+def test_export_filters_parse_comma_separated_ids(admin_client, users):
+    assert exported_ids(admin_client, 'user_ids=12') == [12]
+    assert exported_ids(admin_client, 'user_ids=1,2,12') == [1, 2, 12]
+    assert exported_ids(admin_client, f'node_id={users.id}&enabled=false') == [3]
+
+@pytest.mark.parametrize('query', ['user_ids=1,x', 'node_id=abc', 'format=xml'])
+def test_export_rejects_invalid_parameters(admin_client, users, query):
+    assert admin_client.get(f'/api/users/export?{query}').status_code == 400
+
+def test_bulk_update_applies_filters(app_ctx, admin_client, users):
+    response = admin_client.post('/api/users/bulk', json={'action': 'disable', 'user_ids': [1, 2, 4]})
+    assert response.status_code == 200
+    disabled = app_ctx.UserAccount.query.filter_by(enabled=False).order_by(app_ctx.UserAccount.id)
+    assert [user.id for user in disabled] == [1, 2, 3, 4]
+
+    response = admin_client.post('/api/users/bulk', json={'action': 'set_data_limit', 'data_limit': 5,
+                                                          'node_id': users.id})
+    assert response.status_code == 200
+    limited = app_ctx.UserAccount.query.filter_by(data_limit=5)
+    assert sorted(user.id for user in limited) == [1, 3, 5, 7, 9, 11]
+
+@pytest.mark.parametrize('body', [
+    {'action': 'enable'},
+    {'action': 'enable', 'user_ids': 5},
+    {'action': 'enable', 'user_ids': ['x']},
+    {'action': 'enable', 'node_id': 'abc'},
+    {'action': 'set_data_limit', 'all': True},
+    {'action': 'unknown', 'all': True},
+])
+def test_bulk_update_rejects_invalid_requests(admin_client, users, body):
+    assert admin_client.post('/api/users/bulk', json=body).status_code == 400
+
+def test_import_skips_existing_usernames(app_ctx, admin_client, users):
+    body = 'username,password\nuser1,other\nnew1,uuid-new\nnew2,\n'
+    response = admin_client.post('/api/users/import', data=body, content_type='text/csv')
+    assert response.status_code == 200
+    assert response.json['inserted'] == 2
+    assert app_ctx.UserAccount.query.filter_by(username='user1').one().password == 'uuid-1'
+    assert app_ctx.UserAccount.query.filter_by(username='new1').one().password == 'uuid-new'
+    assert app_ctx.UserAccount.query.filter_by(username='new2').one().password
+
+def test_import_ndjson_rejects_malformed_lines(admin_client, users):
+    body = '{"username": "json1"}\nnot json\n'
+    response = admin_client.post('/api/users/import', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 400
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 节点变更日志单元测试
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from changelog import OP_NODE, OP_REMOVE, OP_UPSERT, build_user_changes, compact_changes
+
+NOW = datetime(2024, 1, 1)
+
+def user_row(user_id, node_id=1, username='alice', password='uuid-a', enabled=True, expire_date=None):
+    return SimpleNamespace(id=user_id, node_id=node_id, username=username, password=password,
+                           enabled=enabled, expire_date=expire_date)
+
+def test_new_user_is_upserted_on_its_node():
+    changes = build_user_changes([user_row(1)], {}, NOW)
+    assert changes == [(1, OP_UPSERT, {'email': 'alice', 'id': 'uuid-a'})]
+
+def test_moved_user_is_removed_from_old_node():
+    changes = build_user_changes([user_row(1, node_id=2)], {1: {(1, 'alice', 'uuid-a')}}, NOW)
+    assert changes == [
+        (1, OP_REMOVE, {'email': 'alice', 'id': 'uuid-a'}),
+        (2, OP_UPSERT, {'email': 'alice', 'id': 'uuid-a'}),
+    ]
+
+def test_password_change_removes_old_identity():
+    changes = build_user_changes([user_row(1, password='uuid-b')], {1: {(1, 'alice', 'uuid-a')}}, NOW)
+    assert changes == [
+        (1, OP_REMOVE, {'email': 'alice', 'id': 'uuid-a'}),
+        (1, OP_UPSERT, {'email': 'alice', 'id': 'uuid-b'}),
+    ]
+
+def test_disabled_and_expired_users_are_removed():
+    rows = [user_row(1, enabled=False), user_row(2, username='bob', expire_date=NOW - timedelta(days=1))]
+    changes = build_user_changes(rows, {}, NOW)
+    assert [(node_id, op, data['email']) for node_id, op, data in changes] == [
+        (1, OP_REMOVE, 'alice'),
+        (1, OP_REMOVE, 'bob'),
+    ]
+
+def test_deleted_user_is_removed():
+    changes = build_user_changes([], {1: {(3, 'alice', 'uuid-a')}}, NOW)
+    assert changes == [(3, OP_REMOVE, {'email': 'alice', 'id': 'uuid-a'})]
+
+def test_unassigned_user_produces_no_changes():
+    assert build_user_changes([user_row(1, node_id=None)], {}, NOW) == []
+
+def test_compact_keeps_last_change_per_user_in_seq_order():
+    entries = [
+        (1, OP_UPSERT, {'email': 'alice', 'id': 'a'}),
+        (2, OP_UPSERT, {'email': 'bob', 'id': 'b'}),
+        (3, OP_NODE, {'enable_vless': True}),
+        (4, OP_REMOVE, {'email': 'alice', 'id': 'a'}),
+        (5, OP_NODE, {'enable_vless': False}),
+    ]
+    assert compact_changes(entries) == [
+        {'seq': 2, 'op': OP_UPSERT, 'data': {'email': 'bob', 'id': 'b'}},
+        {'seq': 4, 'op': OP_REMOVE, 'data': {'email': 'alice', 'id': 'a'}},
+        {'seq': 5, 'op': OP_NODE, 'data': {'enable_vless': False}},
+    ]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 账号到期调度单元测试
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import expiry
+from expiry import MAX_SLEEP, ExpiryScheduler
+
+def test_sleeps_until_next_expiry():
+    upcoming = datetime.utcnow() + timedelta(seconds=2)
+    scheduler = ExpiryScheduler(lambda: 0, lambda: upcoming)
+    assert 1 < scheduler.run_once() <= 2
+
+def test_sleep_is_capped_so_new_expiries_are_picked_up():
+    scheduler = ExpiryScheduler(lambda: 0, lambda: datetime.utcnow() + timedelta(days=1))
+    assert scheduler.run_once() == MAX_SLEEP
+    scheduler = ExpiryScheduler(lambda: 0, lambda: None)
+    assert scheduler.run_once() == MAX_SLEEP
+
+def test_overdue_expiry_runs_immediately():
+    scheduler = ExpiryScheduler(lambda: 0, lambda: datetime.utcnow() - timedelta(seconds=5))
+    assert scheduler.run_once() == 0
+
+def test_only_leader_disables_users():
+    calls = []
+    scheduler = ExpiryScheduler(lambda: calls.append(1) or 0, lambda: None, is_leader=lambda: False)
+    assert scheduler.run_once() == MAX_SLEEP
+    assert calls == []
+
+def test_run_survives_errors(monkeypatch):
+    sleeps = []
+
+    def sleep(delay):
+        sleeps.append(delay)
+        if len(sleeps) == 2:
+            raise SystemExit
+
+    def fail():
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(expiry.time, 'sleep', sleep)
+    with pytest.raises(SystemExit):
+        ExpiryScheduler(fail, lambda: None).run()
+    assert sleeps == [MAX_SLEEP, MAX_SLEEP]
+
+def test_due_users_are_disabled_and_removed_from_their_node(app_ctx, monkeypatch):
+    removed = []
+    monkeypatch.setattr(app_ctx, 'enqueue_user_removals',
+                        lambda rows: removed.extend((row.node_id, row.username) for row in rows))
+    db = app_ctx.db
+    node = app_ctx.Node(name='n1', server_ip='127.0.0.1', token='t1', api_secret='s')
+    db.session.add(node)
+    db.session.commit()
+    now = datetime.utcnow()
+    later = now + timedelta(hours=1)
+    db.session.add_all([
+        app_ctx.UserAccount(username='expired', password='a', node_id=node.id, expire_date=now - timedelta(minutes=1)),
+        app_ctx.UserAccount(username='active', password='b', node_id=node.id, expire_date=later),
+        app_ctx.UserAccount(username='forever', password='c', node_id=node.id),
+    ])
+    db.session.commit()
+
+    scheduler = ExpiryScheduler(app_ctx.disable_expired_users, app_ctx.next_user_expiry)
+    assert 0 < scheduler.run_once() <= MAX_SLEEP
+    assert removed == [(node.id, 'expired')]
+    enabled = {user.username: user.enabled for user in app_ctx.UserAccount.query}
+    assert enabled == {'expired': False, 'active': True, 'forever': True}
+    assert app_ctx.next_user_expiry() == later
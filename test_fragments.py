@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 页面片段缓存单元测试
+"""
+
+import pytest
+from flask import g
+
+from database import on_primary, should_use_replica
+from fragments import FragmentCache
+
+@pytest.fixture(params=['local', 'redis'])
+def cache(request):
+    if request.param == 'local':
+        return FragmentCache()
+    fakeredis = pytest.importorskip('fakeredis')
+    return FragmentCache(fakeredis.FakeRedis())
+
+def test_fragment_is_rendered_once_per_version(cache):
+    calls = []
+
+    def render():
+        calls.append(1)
+        return f'content {len(calls)}'
+
+    assert cache.get_or_render('nodes', render) == 'content 1'
+    assert cache.get_or_render('nodes', render) == 'content 1'
+    cache.bump()
+    assert cache.get_or_render('nodes', render) == 'content 2'
+    assert len(calls) == 2
+
+def test_fragment_expires_after_ttl(cache, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('fragments.time.time', lambda: clock[0])
+    assert cache.get_or_render('nodes', lambda: 'old', ttl=60) == 'old'
+    clock[0] += 61
+    if cache.redis is not None:
+        # Redis按自身时钟过期，这里直接删除键模拟过期
+        cache.redis.flushall()
+    assert cache.get_or_render('nodes', lambda: 'new', ttl=60) == 'new'
+
+def test_on_primary_bypasses_replica_routing(app_module):
+    with app_module.app.test_request_context():
+        g.db_read_only = True
+        assert should_use_replica()
+        assert on_primary(should_use_replica) is False
+        assert should_use_replica()
+
+def test_fleet_change_invalidates_cached_node_list(app_ctx, admin_client):
+    db = app_ctx.db
+    db.session.add(app_ctx.Node(name='n1', server_ip='127.0.0.1', token='t1', api_secret='s'))
+    db.session.commit()
+    assert [node['name'] for node in admin_client.get('/api/nodes').json['nodes']] == ['n1']
+
+    db.session.add(app_ctx.Node(name='n2', server_ip='127.0.0.2', token='t2', api_secret='s'))
+    db.session.commit()
+    assert sorted(node['name'] for node in admin_client.get('/api/nodes').json['nodes']) == ['n1', 'n2']
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 节点健康探测单元测试
+"""
+
+import socket
+import threading
+
+import pytest
+
+from health import REFERENCE_LATENCY_MS, HealthTable, NodeHealth, probe_nodes
+
+def test_score_combines_tls_success_and_latency():
+    node = NodeHealth(1)
+    assert node.score() == 1.0
+    node.record(10, REFERENCE_LATENCY_MS, None, True, True)
+    assert node.score() == pytest.approx(0.5)
+
+    fast = NodeHealth(2)
+    fast.record(5, 20, None, True, True)
+    assert fast.score() > node.score()
+
+def test_tls_failure_lowers_score():
+    node = NodeHealth(1)
+    node.record(10, 20, None, True, True)
+    healthy = node.score()
+    node.record(10, None, None, True, True)
+    assert node.success == pytest.approx(0.7)
+    assert node.score() < healthy
+
+def test_agent_probe_does_not_affect_score():
+    with_agent = NodeHealth(1)
+    without_agent = NodeHealth(2)
+    with_agent.record(10, 20, 5, True, True)
+    without_agent.record(10, 20, None, False, True)
+    assert with_agent.score() == without_agent.score()
+    assert without_agent.to_dict()['agent_ok'] is False
+
+def test_unreachable_node_falls_back_to_heartbeat():
+    node = NodeHealth(1)
+    node.record(10, 20, None, True, True)
+    success = node.success
+    # 探测方到节点的网络不通不计入成功率，节点按心跳判断
+    node.record(None, None, None, False, True)
+    assert node.score() == 1.0
+    assert node.success == success
+    node.record(None, None, None, False, False)
+    assert node.score() == 0.0
+
+def test_table_drops_deleted_nodes_and_sorts_by_score():
+    table = HealthTable()
+    table.record(1, 10, 400, None, True, True)
+    table.record(2, 10, 20, None, True, True)
+    table.record(3, None, None, None, False, False)
+    assert [node['node_id'] for node in table.snapshot()] == [2, 1, 3]
+    table.retain([1])
+    assert [node['node_id'] for node in table.snapshot()] == [1]
+
+@pytest.fixture
+def plain_listener():
+    """只接受TCP连接不支持TLS的端口，TLS握手会失败"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    stop.set()
+    server.close()
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def test_probe_nodes_records_handshakes(plain_listener):
+    table = HealthTable()
+    agent_url = f"http://127.0.0.1:{closed_port()}"
+    results = probe_nodes([(1, '127.0.0.1', agent_url, True)], table, tls_port=plain_listener, timeout=1)
+    assert len(results) == 1
+    result = results[0]
+    assert result['reachable'] is True
+    assert result['tcp_ms'] is not None
+    assert result['tls_ms'] is None
+    assert result['success'] == 0.0
+    assert result['agent_ok'] is False
+    assert result['score'] == 0.0
+
+def test_probe_nodes_unreachable_node_uses_heartbeat():
+    table = HealthTable()
+    port = closed_port()
+    results = probe_nodes([(1, '127.0.0.1', f"http://127.0.0.1:{port}", True)], table, tls_port=port, timeout=1)
+    assert results[0]['reachable'] is False
+    assert results[0]['score'] == 1.0
+    assert probe_nodes([], table) == []
+    assert table.snapshot() == []
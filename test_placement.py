@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 节点分配索引单元测试
+"""
+
+from placement import NodeCapacity, PlacementIndex
+
+def test_place_prefers_node_with_more_free_capacity():
+    index = PlacementIndex([NodeCapacity(1, 'hk', 10, 8), NodeCapacity(2, 'hk', 10, 2)])
+    assert index.place() == 2
+
+def test_place_respects_location_and_capacity():
+    index = PlacementIndex([NodeCapacity(1, 'hk', 1, 0), NodeCapacity(2, 'jp', 10, 0)])
+    assert index.place('hk') == 1
+    assert index.place('hk') is None
+    assert index.place('jp') == 2
+
+def test_place_skips_overloaded_and_unhealthy_nodes():
+    index = PlacementIndex([
+        NodeCapacity(1, 'hk', 10, 0, load=0.95),
+        NodeCapacity(2, 'hk', 10, 0, health=0.1),
+        NodeCapacity(3, 'hk', 10, 9),
+    ])
+    assert index.place() == 3
+    assert index.place() is None
+
+def test_load_and_health_updates_change_ranking():
+    index = PlacementIndex([NodeCapacity(1, 'hk', 10, 0), NodeCapacity(2, 'hk', 10, 1)])
+    index.update_load(1, 0.8)
+    assert index.place() == 2
+    index.update_health(2, 0.0)
+    assert index.place() == 1
+
+def test_release_returns_capacity():
+    index = PlacementIndex([NodeCapacity(1, 'hk', 1, 0)])
+    assert index.place() == 1
+    assert index.place() is None
+    index.release(1)
+    assert index.place() == 1
+
+def test_rebalance_evens_utilization_within_location():
+    index = PlacementIndex([NodeCapacity(1, 'hk', 10, 8), NodeCapacity(2, 'hk', 10, 2),
+                            NodeCapacity(3, 'jp', 10, 10)])
+    assert index.plan_rebalance(tolerance=0.0) == {(1, 2): 3}
+    counts = {node['node_id']: node['user_count'] for node in index.snapshot()}
+    assert counts == {1: 5, 2: 5, 3: 10}
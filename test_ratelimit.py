@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 限流单元测试
+"""
+
+import pytest
+
+from ratelimit import RateLimiter, parse_rate
+
+def test_parse_rate():
+    assert parse_rate('120/60') == (120, 2.0)
+    assert parse_rate('5') == (5, 5.0)
+    with pytest.raises(ValueError):
+        parse_rate('0/60')
+
+def test_token_bucket_allows_burst_then_limits(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: clock[0])
+    limiter = RateLimiter()
+    assert [limiter.hit('ip:1', 3, 1.0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit('ip:1', 3, 1.0) == pytest.approx(1.0)
+    # 其他键不受影响
+    assert limiter.hit('ip:2', 3, 1.0) == 0
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: clock[0])
+    limiter = RateLimiter()
+    for _ in range(2):
+        limiter.hit('node:1', 2, 0.5)
+    assert limiter.hit('node:1', 2, 0.5) > 0
+    clock[0] += 2.0
+    assert limiter.hit('node:1', 2, 0.5) == 0
+    # 补充的令牌不超过桶容量
+    clock[0] += 3600
+    assert [limiter.hit('node:1', 2, 0.5) == 0 for _ in range(3)] == [True, True, False]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 统计样本去重单元测试
+"""
+
+import pytest
+
+def sample(seq, uplink, downlink=0, username='alice'):
+    return {'seq': seq, 'stats': {'users': {username: {'uplink': uplink, 'downlink': downlink}}}}
+
+@pytest.fixture
+def node(app_ctx):
+    db = app_ctx.db
+    node = app_ctx.Node(name='n1', server_ip='127.0.0.1', token='stats-token', api_secret='s')
+    db.session.add(node)
+    db.session.commit()
+    db.session.add(app_ctx.UserAccount(username='alice', password='uuid-a', node_id=node.id))
+    db.session.commit()
+    return node
+
+def used_data(app_ctx):
+    return app_ctx.UserAccount.query.filter_by(username='alice').one().used_data or 0
+
+def test_stats_samples_are_counted_once(app_ctx, node):
+    acked, _ = app_ctx.apply_stats_samples(node, [sample(1, 100), sample(2, 50)])
+    app_ctx.db.session.commit()
+    assert acked == 2
+
+    # 重发已确认的样本不重复计费，只累加新的序号
+    acked, _ = app_ctx.apply_stats_samples(node, [sample(2, 50), sample(1, 100), sample(3, 7)])
+    app_ctx.db.session.commit()
+    assert acked == 3
+    assert used_data(app_ctx) == 157
+
+def test_zero_traffic_samples_advance_cursor(app_ctx, node):
+    acked, disabled = app_ctx.apply_stats_samples(node, [sample(1, 0), sample(2, 0)])
+    app_ctx.db.session.commit()
+    assert (acked, disabled) == (2, [])
+    assert used_data(app_ctx) == 0
+
+def test_samples_without_integer_seq_are_skipped(app_ctx, node):
+    samples = [sample(None, 10), {'stats': {}}, sample('3', 10), sample(True, 10), sample(1, 5)]
+    acked, _ = app_ctx.apply_stats_samples(node, samples)
+    app_ctx.db.session.commit()
+    assert acked == 1
+    assert used_data(app_ctx) == 5
+
+def test_non_numeric_traffic_is_skipped(app_ctx, node):
+    samples = [sample(1, 'abc'), sample(2, None, 4), sample(3, -5), sample(4, 6, '2')]
+    acked, _ = app_ctx.apply_stats_samples(node, samples)
+    app_ctx.db.session.commit()
+    assert acked == 4
+    assert used_data(app_ctx) == 8
+
+def register(app_ctx, node, **extra):
+    client = app_ctx.app.test_client()
+    response = client.post('/api/node/register', json=dict({'token': node.token}, **extra))
+    assert response.status_code == 200
+
+def test_reregistration_keeps_dedup_cursor(app_ctx, node):
+    app_ctx.apply_stats_samples(node, [sample(1, 100), sample(2, 50)])
+    app_ctx.db.session.commit()
+
+    # Agent重启后重新注册并重发尚未确认删除的样本，不重复计费
+    register(app_ctx, node, stats_seq=2)
+    register(app_ctx, node)
+    acked, _ = app_ctx.apply_stats_samples(node, [sample(2, 50), sample(3, 1)])
+    app_ctx.db.session.commit()
+    assert acked == 3
+    assert used_data(app_ctx) == 151
+
+def test_rebuilt_agent_state_rewinds_cursor(app_ctx, node):
+    app_ctx.apply_stats_samples(node, [sample(5, 100)])
+    app_ctx.db.session.commit()
+
+    register(app_ctx, node, stats_seq=0)
+    acked, _ = app_ctx.apply_stats_samples(node, [sample(1, 7)])
+    app_ctx.db.session.commit()
+    assert acked == 1
+    assert used_data(app_ctx) == 107
+
+def test_agent_stats_seq_survives_acknowledgement(tmp_path):
+    from state import StateStore
+    store = StateStore(str(tmp_path / 'state.db'))
+    assert store.last_stats_seq() == 0
+    store.append_stats({'users': {}})
+    seq = store.append_stats({'users': {}})
+    store.ack_stats(seq)
+    assert store.last_stats_seq() == seq
+    assert StateStore(str(tmp_path / 'state.db')).append_stats({'users': {}}) == seq + 1
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 订阅地址与缓存单元测试
+"""
+
+import base64
+import gzip
+
+import pytest
+
+@pytest.fixture
+def user(app_ctx):
+    db = app_ctx.db
+    node = app_ctx.Node(name='n1', server_ip='127.0.0.1', token='sub-token', api_secret='s', enable_vless=True)
+    db.session.add(node)
+    db.session.commit()
+    user = app_ctx.UserAccount(username='alice', password='uuid-a', node_id=node.id)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app_ctx):
+    return app_ctx.app.test_client()
+
+def sub_url(app_ctx, user):
+    return f"/sub/{app_ctx.get_subscription_token(user)}"
+
+def test_token_lookup_requires_matching_secret(app_ctx, client, user):
+    url = sub_url(app_ctx, user)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b'uuid-a' in base64.b64decode(response.data)
+
+    user_id, secret = app_ctx.parse_subscription_token(url.rsplit('/', 1)[1])
+    assert user_id == user.id
+    assert client.get(f"/sub/{user.id}.{'0' * len(secret)}").status_code == 404
+    assert client.get(f"/sub/{user.id}").status_code == 404
+    assert client.get(f"/sub/{user.id + 1}.{secret}").status_code == 404
+    # 旧的顺序ID或用户名形式的地址不再可用
+    assert client.get('/sub/alice').status_code == 404
+
+def test_reset_token_invalidates_old_url(app_ctx, client, user, monkeypatch):
+    monkeypatch.setitem(app_ctx.app.config, 'LOGIN_DISABLED', True)
+    old = sub_url(app_ctx, user)
+    assert client.get(old).status_code == 200
+    new = client.post(f'/api/user/{user.id}/subscription/reset').json['subscription_url']
+    assert client.get(old).status_code == 404
+    assert client.get(new.split('localhost', 1)[1]).status_code == 200
+
+@pytest.mark.parametrize('headers, query', [
+    ({}, ''),
+    ({'Accept-Encoding': 'gzip'}, ''),
+    ({}, '?format=json'),
+])
+def test_each_representation_supports_conditional_get(app_ctx, client, user, headers, query):
+    url = sub_url(app_ctx, user) + query
+    response = client.get(url, headers=headers)
+    etag = response.headers['ETag']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    cached = client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+    assert cached.headers['Subscription-Userinfo'] == response.headers['Subscription-Userinfo']
+
+def test_representations_have_distinct_etags(app_ctx, client, user):
+    url = sub_url(app_ctx, user)
+    plain = client.get(url)
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    as_json = client.get(url + '?format=json')
+    assert len({plain.headers['ETag'], compressed.headers['ETag'], as_json.headers['ETag']}) == 3
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert as_json.json['links'] == [line for line in base64.b64decode(plain.data).decode().split('\n') if line]
+    # 一种表示的ETag不能让另一种表示返回304
+    assert client.get(url, headers={'If-None-Match': compressed.headers['ETag']}).status_code == 200
+
+def test_user_change_updates_etag(app_ctx, client, user):
+    url = sub_url(app_ctx, user)
+    etag = client.get(url).headers['ETag']
+    user.enabled = False
+    app_ctx.db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert base64.b64decode(response.data) == b''
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - Agent账号与节点配置同步单元测试
+"""
+
+from sync import apply_changes, apply_node_config, apply_snapshot
+
+def make_config():
+    return {'inbounds': [
+        {'protocol': 'vless', 'settings': {'clients': [{'id': 'default', 'flow': 'xtls-rprx-vision'}]}},
+        {'protocol': 'vless', 'streamSettings': {'network': 'xhttp'}, 'settings': {'clients': []}},
+        {'protocol': 'dokodemo-door', 'settings': {}},
+    ]}
+
+def clients(config, index):
+    return config['inbounds'][index]['settings']['clients']
+
+def test_changes_upsert_and_remove_managed_clients():
+    config = make_config()
+    assert apply_changes(config, [{'op': 'upsert', 'data': {'email': 'alice', 'id': 'a'}}])
+    assert clients(config, 0) == [{'id': 'default', 'flow': 'xtls-rprx-vision'},
+                                  {'id': 'a', 'email': 'alice', 'flow': 'xtls-rprx-vision'}]
+    assert not apply_changes(config, [{'op': 'upsert', 'data': {'email': 'alice', 'id': 'a'}}])
+    assert apply_changes(config, [{'op': 'remove', 'data': {'email': 'alice', 'id': 'a'}}])
+    assert clients(config, 0) == [{'id': 'default', 'flow': 'xtls-rprx-vision'}]
+
+def test_snapshot_replaces_only_managed_clients():
+    config = make_config()
+    apply_changes(config, [{'op': 'upsert', 'data': {'email': 'old', 'id': 'o'}}])
+    assert apply_snapshot(config, [{'email': 'bob', 'id': 'b'}])
+    assert [c.get('email') for c in clients(config, 0)] == [None, 'bob']
+    assert [c.get('email') for c in clients(config, 1)] == ['bob']
+
+def test_disabled_protocol_drops_managed_clients_and_skips_changes():
+    config = make_config()
+    apply_snapshot(config, [{'email': 'bob', 'id': 'b'}])
+    flags = {'enable_vless': True, 'enable_splithttp': False, 'enable_hysteria2': False}
+    assert apply_node_config(config, flags) == (True, False)
+    assert clients(config, 1) == []
+    apply_changes(config, [{'op': 'upsert', 'data': {'email': 'carol', 'id': 'c'}}], flags)
+    assert clients(config, 1) == []
+    assert [c.get('email') for c in clients(config, 0)] == [None, 'bob', 'carol']
+
+def test_disabling_keeps_inbound_and_unmanaged_clients():
+    config = make_config()
+    apply_snapshot(config, [{'email': 'bob', 'id': 'b'}])
+    modified, _ = apply_node_config(config, {'enable_vless': False})
+    assert modified
+    assert len(config['inbounds']) == 3
+    assert clients(config, 0) == [{'id': 'default', 'flow': 'xtls-rprx-vision'}]
+
+def test_reenabled_protocol_requests_snapshot():
+    config = make_config()
+    assert apply_node_config(config, {'enable_splithttp': True}, {'enable_splithttp': False}) == (False, True)
+    assert apply_node_config(config, {'enable_splithttp': True}, {'enable_splithttp': True}) == (False, False)
+    assert apply_node_config(config, None, {'enable_splithttp': False}) == (False, False)
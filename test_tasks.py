@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 后台任务队列单元测试
+"""
+
+import pytest
+
+import tasks
+from tasks import STATUS_FAILED, STATUS_FINISHED, STATUS_RETRYING, TaskQueue
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeRedis()
+
+def make_queue(redis_client, worker_id='w1', calls=None, fail=0):
+    queue = TaskQueue(redis_client, worker_id=worker_id)
+    calls = [] if calls is None else calls
+
+    @queue.task('push')
+    def push(node_id):
+        calls.append(node_id)
+        if len(calls) <= fail:
+            raise RuntimeError('agent unreachable')
+        return {'node_id': node_id}
+
+    return queue
+
+def test_dedup_key_collapses_queued_jobs(redis_client):
+    calls = []
+    queue = make_queue(redis_client, calls=calls)
+    first = queue.enqueue('push', {'node_id': 1}, dedup_key='push:1')
+    assert queue.enqueue('push', {'node_id': 1}, dedup_key='push:1') == first
+    assert queue.enqueue('push', {'node_id': 2}, dedup_key='push:2') != first
+
+    assert queue.work_once(timeout=0)
+    # 任务开始执行后同一个键可以再次入队
+    assert queue.enqueue('push', {'node_id': 1}, dedup_key='push:1') != first
+    assert queue.get_status(first)['status'] == STATUS_FINISHED
+    assert queue.get_status(first)['result'] == {'node_id': 1}
+
+def test_failed_job_is_retried_with_backoff(redis_client, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('tasks.time.time', lambda: clock[0])
+    queue = make_queue(redis_client, fail=1)
+    job_id = queue.enqueue('push', {'node_id': 1}, max_retries=1)
+
+    assert queue.work_once(timeout=0)
+    assert queue.get_status(job_id)['status'] == STATUS_RETRYING
+    assert not queue.work_once(timeout=0)
+
+    clock[0] += tasks.RETRY_BACKOFF
+    assert queue.work_once(timeout=0)
+    assert queue.get_status(job_id)['status'] == STATUS_FINISHED
+    assert queue.get_status(job_id)['attempts'] == 2
+
+def test_job_fails_after_max_retries(redis_client, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('tasks.time.time', lambda: clock[0])
+    queue = make_queue(redis_client, fail=10)
+    job_id = queue.enqueue('push', {'node_id': 1}, max_retries=1)
+    queue.work_once(timeout=0)
+    clock[0] += tasks.RETRY_BACKOFF
+    queue.work_once(timeout=0)
+    status = queue.get_status(job_id)
+    assert status['status'] == STATUS_FAILED
+    assert status['error'] == 'agent unreachable'
+
+def test_orphaned_jobs_of_dead_worker_are_requeued(redis_client):
+    dead = make_queue(redis_client, worker_id='old-container')
+    job_id = dead.enqueue('push', {'node_id': 1})
+    # 模拟Worker取出任务后容器被删除：任务留在其执行中列表，心跳过期
+    redis_client.lmove(dead._queue_key, dead._processing_key, 'RIGHT', 'LEFT')
+
+    alive = make_queue(redis_client, worker_id='busy-worker')
+    alive.heartbeat()
+    redis_client.rpush(alive._processing_key, 'running-job')
+
+    calls = []
+    worker = make_queue(redis_client, worker_id='new-container', calls=calls)
+    assert worker.requeue_orphans() == 1
+    assert redis_client.lrange(alive._processing_key, 0, -1) == [b'running-job']
+    assert worker.work_once(timeout=0)
+    assert calls == [1]
+    assert worker.get_status(job_id)['status'] == STATUS_FINISHED
+
+def test_without_redis_jobs_run_synchronously():
+    calls = []
+    queue = make_queue(None, calls=calls)
+    job_id = queue.enqueue('push', {'node_id': 3})
+    assert calls == [3]
+    assert queue.get_status(job_id)['status'] == STATUS_FINISHED
+    with pytest.raises(ValueError):
+        queue.enqueue('unknown')
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理系统 - 上报编码单元测试
+"""
+
+import gzip
+import json
+
+import pytest
+
+from wire import decode_body
+
+def test_decode_plain_and_gzip_json():
+    payload = {'node_id': 1, 'stats': {'users': {}}}
+    raw = json.dumps(payload).encode()
+    assert decode_body(raw, 'application/json', None, 1024) == payload
+    assert decode_body(gzip.compress(raw), 'application/json', 'gzip', 1024) == payload
+
+def test_decode_rejects_oversized_gzip_body():
+    body = gzip.compress(b'[' + b'0,' * 10000 + b'0]')
+    with pytest.raises(ValueError):
+        decode_body(body, 'application/json', 'gzip', 1024)
+
+def test_decode_rejects_corrupt_and_unknown_encodings():
+    with pytest.raises(ValueError):
+        decode_body(b'not gzip', 'application/json', 'gzip', 1024)
+    with pytest.raises(ValueError):
+        decode_body(b'{}', 'application/json', 'br', 1024)
+
+def test_decode_msgpack():
+    msgpack = pytest.importorskip('msgpack')
+    payload = {'node_id': 1, 'seq': 7}
+    assert decode_body(msgpack.packb(payload), 'application/msgpack', None, 1024) == payload
+    with pytest.raises(ValueError):
+        decode_body(b'\xc1', 'application/msgpack', None, 1024)
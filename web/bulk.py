@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 用户批量导入导出
+流式生成CSV/JSON导出内容，逐行解析导入数据并按批通过COPY写入数据库
+"""
+
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+from subscription import generate_subscription_token
+
+# 导入导出的字段顺序
+USER_FIELDS = ('id', 'username', 'password', 'email', 'data_limit', 'used_data',
+               'enabled', 'expire_date', 'created_at', 'node_id')
+
+# 导入时写入的字段，COPY不经过ORM，订阅密钥在规范化时生成
+IMPORT_FIELDS = ('username', 'password', 'email', 'data_limit', 'used_data',
+                 'enabled', 'expire_date', 'node_id', 'subscription_token')
+
+# 默认流量上限（字节）
+DEFAULT_DATA_LIMIT = 107374182400
+
+class UserImportError(ValueError):
+    """导入数据格式错误，line 为出错的行号"""
+
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _row_dict(row):
+    return {field: _format_value(value) for field, value in zip(USER_FIELDS, row)}
+
+def iter_csv(rows):
+    """把查询结果逐行编码为CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(USER_FIELDS)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in map(_format_value, row)])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_json(rows):
+    """把查询结果逐行编码为JSON数组"""
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(_row_dict(row), ensure_ascii=False)
+        first = False
+    yield ']'
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (None, ''):
+        return True
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+def _parse_int(value, default=None):
+    if value in (None, ''):
+        return default
+    return int(value)
+
+def _parse_datetime(value):
+    if value in (None, ''):
+        return None
+    return datetime.fromisoformat(str(value))
+
+def normalize_user(record, line):
+    """校验并规范化一条导入记录，缺少密码时生成UUID"""
+    username = (record.get('username') or '').strip()
+    if not username or len(username) > 100:
+        raise UserImportError(line, 'invalid username')
+    try:
+        return {
+            'username': username,
+            'password': record.get('password') or str(uuid.uuid4()),
+            'email': record.get('email') or None,
+            'data_limit': _parse_int(record.get('data_limit'), DEFAULT_DATA_LIMIT),
+            'used_data': _parse_int(record.get('used_data'), 0),
+            'enabled': _parse_bool(record.get('enabled')),
+            'expire_date': _parse_datetime(record.get('expire_date')),
+            'node_id': _parse_int(record.get('node_id')),
+            'subscription_token': generate_subscription_token(),
+        }
+    except (TypeError, ValueError) as e:
+        raise UserImportError(line, str(e)) from None
+
+def iter_import_records(stream, fmt):
+    """逐行读取导入数据，fmt 为 'csv'（首行为表头）或 'json'（每行一个JSON对象）"""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        for line, record in enumerate(csv.DictReader(text), start=2):
+            yield normalize_user(record, line)
+        return
+
+    for line, raw in enumerate(text, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            raise UserImportError(line, 'invalid JSON') from None
+        if not isinstance(record, dict):
+            raise UserImportError(line, 'expected an object')
+        yield normalize_user(record, line)
+
+def batched(iterable, size):
+    """按固定大小分批"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def copy_users(connection, table_name, users):
+    """通过临时表和COPY批量写入用户，用户名已存在的记录跳过，返回写入条数
+
+    connection 为当前事务的SQLAlchemy连接，仅支持PostgreSQL。
+    """
+    columns = ', '.join(IMPORT_FIELDS)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user in users:
+        writer.writerow([
+            r'\N' if user[field] is None else _format_value(user[field])
+            for field in IMPORT_FIELDS
+        ])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE user_import ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table_name} WITH NO DATA"
+        )
+        cursor.copy_expert(
+            f"COPY user_import ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+        cursor.execute(
+            f"INSERT INTO {table_name} ({columns}, created_at) "
+            f"SELECT {columns}, now() FROM user_import "
+            f"ON CONFLICT (username) DO NOTHING"
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
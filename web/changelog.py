@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 节点变更日志
+把账号和节点配置的变更转换为按节点记录的变更条目，Agent按序号增量同步，
+同步开销只与变更数量有关，与节点上的账号总数无关
+"""
+
+from datetime import datetime
+
+# 变更类型
+OP_UPSERT = 'upsert'    # 添加或更新账号
+OP_REMOVE = 'remove'    # 删除账号
+OP_NODE = 'node'        # 节点配置开关变化
+
+# 影响节点上账号列表和配置的字段，其他字段（已用流量、流量限额等）的变化不记录
+USER_CHANGE_FIELDS = ('username', 'password', 'enabled', 'expire_date', 'node_id')
+NODE_CHANGE_FIELDS = ('enable_vless', 'enable_splithttp', 'enable_hysteria2', 'max_users')
+
+def user_client(username, password):
+    """账号在Xray配置中的表示，email 为账号名，id 为UUID或密码"""
+    return {'email': username, 'id': password}
+
+def is_active(row, now=None):
+    """账号当前是否应出现在节点上"""
+    now = now or datetime.utcnow()
+    return bool(row.enabled and row.node_id is not None
+                and (row.expire_date is None or row.expire_date > now))
+
+def build_user_changes(rows, previous, now=None):
+    """根据账号的当前状态和变更前的身份生成变更条目
+
+    rows 为账号当前状态（已删除的账号不在其中），previous 为 {账号ID: {(节点ID, 账号名, 密码)}}，
+    记录本次事务中账号变更前所在的节点和身份。返回 [(节点ID, 类型, 内容)]。
+    账号离开节点、被禁用或更换账号名/密码时在原节点上删除旧身份，仍然有效时在当前节点上添加。
+    """
+    now = now or datetime.utcnow()
+    changes = []
+    current = {row.id: row for row in rows}
+    for user_id in sorted(set(current) | set(previous)):
+        row = current.get(user_id)
+        identity = (row.node_id, row.username, row.password) if row is not None else None
+        active = row is not None and is_active(row, now)
+
+        stale = set(previous.get(user_id, ()))
+        if row is not None and not active:
+            stale.add(identity)
+        elif active:
+            stale.discard(identity)
+        for node_id, username, password in sorted(stale, key=lambda item: (item[0] or 0, item[1])):
+            if node_id is not None:
+                changes.append((node_id, OP_REMOVE, user_client(username, password)))
+
+        if active:
+            changes.append((row.node_id, OP_UPSERT, user_client(row.username, row.password)))
+    return changes
+
+def node_config(node):
+    """节点配置开关，作为 node 类型变更的内容"""
+    return {field: getattr(node, field) for field in NODE_CHANGE_FIELDS}
+
+def compact_changes(entries):
+    """合并同一账号的多次变更，只保留最后一次，顺序按最后一次变更的序号
+
+    entries 为按序号排列的 (序号, 类型, 内容)。
+    """
+    latest = {}
+    for seq, op, payload in entries:
+        key = OP_NODE if op == OP_NODE else payload.get('email')
+        latest.pop(key, None)
+        latest[key] = {'seq': seq, 'op': op, 'data': payload}
+    return list(latest.values())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 多实例协调
+Redis会话存储、分布式锁和主节点选举，使Master可以水平扩展为多个副本
+"""
+
+import logging
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import redis
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from redis.exceptions import LockError
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+# 非永久会话在服务端的保留时间
+SESSION_TTL = timedelta(days=1)
+
+class RedisSession(CallbackDict, SessionMixin):
+    """保存在Redis中的会话，Cookie中只有随机的会话ID"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """登录等权限变化后更换会话ID，防止会话固定攻击"""
+        self.previous_sid = self.previous_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+class RedisSessionInterface(SessionInterface):
+    """Redis会话存储，多个Master副本共享登录状态，注销后立即失效"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, redis_client, prefix='session:'):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def _key(self, sid):
+        return f"{self.prefix}{sid}"
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                raw = self.redis.get(self._key(sid))
+            except redis.RedisError as e:
+                logger.warning(f"读取会话失败: {e}")
+                raw = None
+            if raw is not None:
+                try:
+                    return RedisSession(self.serializer.loads(raw.decode()), sid=sid)
+                except ValueError:
+                    pass
+        return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        try:
+            if session.previous_sid:
+                self.redis.delete(self._key(session.previous_sid))
+
+            if not session:
+                if session.modified:
+                    self.redis.delete(self._key(session.sid))
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+
+            ttl = app.permanent_session_lifetime if session.permanent else SESSION_TTL
+            if session.modified or self.should_set_cookie(app, session):
+                self.redis.setex(self._key(session.sid), ttl, self.serializer.dumps(dict(session)))
+        except redis.RedisError as e:
+            logger.error(f"保存会话失败: {e}")
+            return
+
+        if self.should_set_cookie(app, session) or session.previous_sid:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+class Coordinator:
+    """分布式锁与主节点选举
+
+    锁基于 redis-py 的 Lock（SET NX PX 加持有者校验）。未配置Redis时只有单实例，
+    锁退化为进程内锁，选举始终成功。
+    """
+
+    def __init__(self, redis_client=None, instance_id=None):
+        self.redis = redis_client
+        self.instance_id = instance_id or f"{socket.gethostname()}-{secrets.token_hex(4)}"
+        self._local_locks = {}
+        self._local_guard = threading.Lock()
+
+    @contextmanager
+    def lock(self, name, ttl=60, blocking_timeout=None):
+        """获取分布式锁，blocking_timeout 内未获取到时抛出 LockError"""
+        if self.redis is None:
+            with self._local_guard:
+                local = self._local_locks.setdefault(name, threading.Lock())
+            if not local.acquire(timeout=-1 if blocking_timeout is None else blocking_timeout):
+                raise LockError(f"Could not acquire lock: {name}")
+            try:
+                yield
+            finally:
+                local.release()
+            return
+
+        lock = self.redis.lock(f"lock:{name}", timeout=ttl, blocking_timeout=blocking_timeout)
+        if not lock.acquire():
+            raise LockError(f"Could not acquire lock: {name}")
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning(f"锁 {name} 已过期，执行时间超过 {ttl} 秒")
+
+    def leader(self, group, ttl=30):
+        """返回一个主节点选举器"""
+        return LeaderElection(self, group, ttl)
+
+class LeaderElection:
+    """基于租约的主节点选举
+
+    主节点在后台线程中每隔 ttl/3 续约，不受周期任务执行时长影响；宕机后租约在 ttl 秒内过期，其他实例接任。
+    """
+
+    def __init__(self, coordinator, group, ttl=30):
+        self.coordinator = coordinator
+        self.group = group
+        self.ttl = ttl
+        self._lock = None
+        # 租约在本地的过期时间（monotonic），按发起续约的时刻计算，不会晚于Redis中的实际过期时间
+        self._expires_at = 0
+        self._refresh_lock = threading.Lock()
+        self._keepalive = None
+
+    @property
+    def is_leader(self):
+        if self.coordinator.redis is None:
+            return True
+        return self._lock is not None and time.monotonic() < self._expires_at
+
+    def refresh(self):
+        """尝试获取或续约租约，返回当前是否为主节点"""
+        redis_client = self.coordinator.redis
+        if redis_client is None:
+            return True
+
+        with self._refresh_lock:
+            started = time.monotonic()
+            try:
+                if self._lock is not None:
+                    try:
+                        self._lock.reacquire()
+                        self._expires_at = started + self.ttl
+                        return True
+                    except LockError:
+                        logger.warning(f"失去 {self.group} 主节点身份")
+                        self._lock = None
+
+                lock = redis_client.lock(f"leader:{self.group}", timeout=self.ttl, blocking=False)
+                if lock.acquire(token=self.coordinator.instance_id):
+                    logger.info(f"成为 {self.group} 主节点: {self.coordinator.instance_id}")
+                    self._lock = lock
+                    self._expires_at = started + self.ttl
+                    return True
+            except redis.RedisError as e:
+                logger.error(f"主节点选举失败: {e}")
+                self._lock = None
+            return False
+
+    def start_keepalive(self):
+        """启动后台续约线程，重复调用只启动一次"""
+        if self._keepalive is not None:
+            return
+
+        def keepalive():
+            while True:
+                self.refresh()
+                time.sleep(self.ttl / 3)
+
+        self._keepalive = threading.Thread(target=keepalive, name=f"leader-{self.group}", daemon=True)
+        self._keepalive.start()
+
+    def run_periodic(self, tasks, app=None):
+        """主节点循环执行周期任务，tasks 为 [(名称, 间隔秒数, 函数)]
+
+        非主节点只参与选举，保证每个周期任务在整个集群中只执行一次。
+        每个任务开始前检查租约，任务执行期间租约由后台线程续约。
+        """
+        self.start_keepalive()
+        next_run = {name: 0 for name, _, _ in tasks}
+        while True:
+            if self.is_leader:
+                for name, interval, func in tasks:
+                    if time.monotonic() < next_run[name]:
+                        continue
+                    if not self.is_leader:
+                        break
+                    next_run[name] = time.monotonic() + interval
+                    try:
+                        if app is not None:
+                            with app.app_context():
+                                func()
+                        else:
+                            func()
+                    except Exception as e:
+                        logger.error(f"周期任务 {name} 执行失败: {e}")
+            time.sleep(self.ttl / 3)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 数据库连接配置与读写分离
+按环境变量配置连接池，只读路由的查询发往只读副本，管理员修改后短时间内固定读主库
+"""
+
+import os
+import random
+import time
+from functools import wraps
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.pool import NullPool
+
+# 只读副本的绑定名前缀
+REPLICA_BIND_PREFIX = 'replica_'
+
+# 管理员写入后固定读主库的时间（秒），需大于副本复制延迟
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('DB_STICKY_SECONDS', 10))
+
+# 会话中记录固定读主库截止时间的键
+PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+def build_engine_options(database_url):
+    """根据环境变量生成引擎参数，连接池大小针对单个gunicorn worker进程"""
+    if not database_url.startswith('postgresql'):
+        return {}
+
+    # PgBouncer事务池模式下由PgBouncer负责复用连接，应用侧不再持有连接
+    if os.environ.get('DB_PGBOUNCER', '').lower() in ('1', 'true', 'yes'):
+        return {'poolclass': NullPool}
+
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+def build_replica_binds(replica_urls):
+    """将逗号分隔的只读副本地址转换为 SQLALCHEMY_BINDS 配置"""
+    urls = [url.strip() for url in (replica_urls or '').split(',') if url.strip()]
+    return {f"{REPLICA_BIND_PREFIX}{i}": url for i, url in enumerate(urls)}
+
+def read_only(view):
+    """标记只读路由，其查询优先发往只读副本"""
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return decorated
+
+def should_use_replica():
+    """当前请求是否可以读副本"""
+    if not has_request_context() or not g.get('db_read_only'):
+        return False
+    primary_until = session.get(PRIMARY_UNTIL_KEY)
+    return not primary_until or primary_until < time.time()
+
+def on_primary(func):
+    """调用 func()，其中的查询即使在只读路由中也发往主库，返回其结果"""
+    if not has_request_context():
+        return func()
+    previous = g.get('db_read_only')
+    g.db_read_only = False
+    try:
+        return func()
+    finally:
+        g.db_read_only = previous
+
+def mark_primary_sticky():
+    """管理员写入后在会话中记录固定读主库的截止时间"""
+    session[PRIMARY_UNTIL_KEY] = time.time() + READ_YOUR_WRITES_SECONDS
+
+class RoutingSession(Session):
+    """读写分离会话：只读路由中的非flush查询发往随机选择的只读副本，其余发往主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and should_use_replica():
+            # 同一请求内固定使用一个副本，避免不同查询看到不同的复制进度
+            if 'db_replica_key' not in g:
+                keys = [key for key in self._db.engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+                g.db_replica_key = random.choice(keys) if keys else None
+            if g.db_replica_key is not None:
+                return self._db.engines[g.db_replica_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
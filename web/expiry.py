@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 账号到期调度
+按到期时间索引找到下一个到期的账号，休眠到该时刻再禁用，无需定时扫描整张用户表
+"""
+
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 最长休眠时间（秒），管理员新设置的更早到期时间最迟在此时间内生效
+MAX_SLEEP = 5
+
+class ExpiryScheduler:
+    """账号到期调度循环
+
+    disable_due() 禁用所有已到期账号并返回禁用数量；next_expiry() 返回下一个到期时间（UTC，无则None）；
+    is_leader() 返回当前实例是否负责调度，多副本时只有主节点执行。
+    """
+
+    def __init__(self, disable_due, next_expiry, is_leader=lambda: True, app=None):
+        self.disable_due = disable_due
+        self.next_expiry = next_expiry
+        self.is_leader = is_leader
+        self.app = app
+
+    def _in_context(self, func):
+        if self.app is None:
+            return func()
+        with self.app.app_context():
+            return func()
+
+    def run_once(self):
+        """处理到期账号，返回下次检查前应休眠的秒数"""
+        if not self.is_leader():
+            return MAX_SLEEP
+
+        count = self._in_context(self.disable_due)
+        if count:
+            logger.info(f"已禁用 {count} 个到期账号")
+
+        upcoming = self._in_context(self.next_expiry)
+        if upcoming is None:
+            return MAX_SLEEP
+        delay = (upcoming - datetime.utcnow()).total_seconds()
+        return min(max(delay, 0), MAX_SLEEP)
+
+    def run(self):
+        """持续调度"""
+        while True:
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.error(f"到期调度失败: {e}")
+                delay = MAX_SLEEP
+            time.sleep(delay)
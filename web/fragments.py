@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 管理页面片段缓存
+节点列表、用户列表等渲染开销大的页面片段按集群版本号缓存，节点或用户变更时递增版本号即全部失效
+"""
+
+import logging
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# 缓存键前缀
+FRAGMENT_PREFIX = 'fragment'
+
+# 集群版本号的键
+VERSION_KEY = 'fleet:version'
+
+# 片段过期时间（秒），最后在线时间、已用流量等不触发版本变化的字段按此周期刷新
+FRAGMENT_TTL = 60
+
+class FragmentCache:
+    """按集群版本号缓存渲染结果
+
+    版本号需在读取数据库之前获取，与订阅缓存相同，避免并发修改时写入过期内容。
+    未配置Redis时退化为进程内字典，只在当前进程内失效。
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self._local = {}
+        self._local_version = 0
+
+    def version(self):
+        """读取当前集群版本号，Redis不可用时返回None"""
+        if self.redis is None:
+            return self._local_version
+        try:
+            return int(self.redis.get(VERSION_KEY) or 0)
+        except redis.RedisError as e:
+            logger.warning(f"读取集群版本号失败: {e}")
+            return None
+
+    def bump(self):
+        """节点或用户变更后递增版本号"""
+        self._local_version += 1
+        if self.redis is None:
+            return
+        try:
+            self.redis.incr(VERSION_KEY)
+        except redis.RedisError as e:
+            logger.error(f"递增集群版本号失败: {e}")
+
+    def get_or_render(self, name, render, ttl=FRAGMENT_TTL):
+        """返回缓存的片段，未命中时调用 render() 生成并缓存"""
+        version = self.version()
+        if version is None:
+            return render()
+
+        if self.redis is None:
+            entry = self._local.get(name)
+            if entry and entry[0] == version and entry[1] > time.time():
+                return entry[2]
+            content = render()
+            self._local[name] = (version, time.time() + ttl, content)
+            return content
+
+        key = f"{FRAGMENT_PREFIX}:{name}:{version}"
+        try:
+            cached = self.redis.get(key)
+            if cached is not None:
+                return cached.decode()
+        except redis.RedisError as e:
+            logger.warning(f"读取片段缓存失败: {e}")
+
+        content = render()
+        try:
+            self.redis.set(key, content, ex=ttl)
+        except redis.RedisError as e:
+            logger.warning(f"写入片段缓存失败: {e}")
+        return content
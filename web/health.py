@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 节点健康探测
+用asyncio并发测量各节点的TCP握手、TLS握手和Agent /health 延迟，
+以指数加权移动平均（EWMA）计算健康分数，供节点分配和管理API使用。
+健康分数只取决于代理端口的TLS握手，Agent健康检查仅供参考
+"""
+
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# EWMA平滑系数，越大越偏向最近的探测结果
+EWMA_ALPHA = 0.3
+
+# 参考延迟（毫秒），延迟等于该值时延迟因子为0.5
+REFERENCE_LATENCY_MS = 200.0
+
+# 单个探测步骤的超时（秒）
+PROBE_TIMEOUT = 5
+
+# 同时探测的节点数上限
+PROBE_CONCURRENCY = 100
+
+class NodeHealth:
+    """单个节点的探测结果，延迟和TLS握手成功率均为EWMA"""
+
+    __slots__ = ('node_id', 'tcp_ms', 'tls_ms', 'agent_ms', 'agent_ok', 'success',
+                 'reachable', 'alive', 'probed_at')
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.tcp_ms = None
+        self.tls_ms = None
+        self.agent_ms = None
+        self.agent_ok = None
+        self.success = None
+        self.reachable = None
+        self.alive = None
+        self.probed_at = None
+
+    @staticmethod
+    def _ewma(previous, value):
+        if value is None:
+            return previous
+        if previous is None:
+            return value
+        return EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+    def record(self, tcp_ms, tls_ms, agent_ms, agent_ok, alive):
+        """记录一轮探测，alive 为节点心跳是否未超时
+
+        TCP连接失败时无法区分节点故障和探测方网络受限，这一轮不计入成功率，
+        只有TCP连通而TLS握手失败才算作失败。
+        """
+        self.reachable = tcp_ms is not None
+        self.alive = alive
+        if self.reachable:
+            self.tcp_ms = self._ewma(self.tcp_ms, tcp_ms)
+            self.tls_ms = self._ewma(self.tls_ms, tls_ms)
+            self.success = self._ewma(self.success, 1.0 if tls_ms is not None else 0.0)
+        self.agent_ms = self._ewma(self.agent_ms, agent_ms)
+        self.agent_ok = agent_ok
+        self.probed_at = time.time()
+
+    def score(self):
+        """健康分数（0~1），综合TLS握手成功率和握手延迟"""
+        if self.reachable is False:
+            # 探测不可达时不据此排除节点，按心跳判断
+            return 1.0 if self.alive else 0.0
+        if self.success is None:
+            return 1.0
+        latency = self.tls_ms if self.tls_ms is not None else self.tcp_ms
+        return self.success * REFERENCE_LATENCY_MS / (REFERENCE_LATENCY_MS + latency)
+
+    def to_dict(self):
+        def rounded(value):
+            return None if value is None else round(value, 1)
+        return {
+            'node_id': self.node_id,
+            'score': round(self.score(), 3),
+            'tcp_ms': rounded(self.tcp_ms),
+            'tls_ms': rounded(self.tls_ms),
+            'agent_ms': rounded(self.agent_ms),
+            'agent_ok': self.agent_ok,
+            'success': None if self.success is None else round(self.success, 3),
+            'reachable': self.reachable,
+            'probed_at': self.probed_at,
+        }
+
+class HealthTable:
+    """各节点健康状态的内存表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = {}
+
+    def record(self, node_id, tcp_ms, tls_ms, agent_ms, agent_ok, alive):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None:
+                node = self._nodes[node_id] = NodeHealth(node_id)
+            node.record(tcp_ms, tls_ms, agent_ms, agent_ok, alive)
+            return node.to_dict()
+
+    def retain(self, node_ids):
+        """丢弃已删除节点的状态"""
+        with self._lock:
+            for node_id in set(self._nodes) - set(node_ids):
+                del self._nodes[node_id]
+
+    def snapshot(self):
+        """返回所有节点的健康状态，按分数从高到低排列"""
+        with self._lock:
+            return sorted((node.to_dict() for node in self._nodes.values()),
+                          key=lambda item: item['score'], reverse=True)
+
+def _handshake_context():
+    # 只测量握手耗时，节点证书通常签发给域名而探测使用IP，不校验证书
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+async def _timed_connect(host, port, ssl_context=None, timeout=PROBE_TIMEOUT):
+    """建立连接，返回 (reader, writer, 耗时毫秒)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=ssl_context), timeout
+    )
+    return reader, writer, (time.perf_counter() - start) * 1000
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+
+async def _measure_handshake(host, port, ssl_context=None, timeout=PROBE_TIMEOUT):
+    """测量TCP（或TCP+TLS）握手耗时，失败时返回None"""
+    try:
+        _, writer, elapsed = await _timed_connect(host, port, ssl_context, timeout)
+    except (OSError, ssl.SSLError, asyncio.TimeoutError):
+        return None
+    await _close(writer)
+    return elapsed
+
+async def _measure_health(host, port, path, ssl_context=None, timeout=PROBE_TIMEOUT):
+    """请求Agent健康检查，返回 (是否返回200, 耗时毫秒)"""
+    start = time.perf_counter()
+    try:
+        reader, writer, _ = await _timed_connect(host, port, ssl_context, timeout)
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+        finally:
+            await _close(writer)
+    except (OSError, ssl.SSLError, asyncio.TimeoutError):
+        return False, None
+    parts = status_line.split()
+    ok = len(parts) >= 2 and parts[1] == b'200'
+    return ok, (time.perf_counter() - start) * 1000
+
+async def probe_node(host, agent_url, tls_port=443, timeout=PROBE_TIMEOUT):
+    """探测一个节点，返回 (TCP握手毫秒, TLS握手毫秒, Agent健康检查毫秒, Agent是否健康)
+
+    agent_url 为Agent的访问地址（如 http://agent:8080），健康检查请求其下的 /health
+    """
+    context = _handshake_context()
+    agent = urlsplit(agent_url)
+    agent_tls = agent.scheme == 'https'
+    agent_port = agent.port or (443 if agent_tls else 80)
+    tcp_ms, tls_ms, (ok, agent_ms) = await asyncio.gather(
+        _measure_handshake(host, tls_port, None, timeout),
+        _measure_handshake(host, tls_port, context, timeout),
+        _measure_health(agent.hostname, agent_port, agent.path.rstrip('/') + '/health',
+                        context if agent_tls else None, timeout),
+    )
+    return tcp_ms, tls_ms, agent_ms, ok
+
+def probe_nodes(targets, table, tls_port=443, timeout=PROBE_TIMEOUT, concurrency=PROBE_CONCURRENCY):
+    """并发探测 targets（[(节点ID, 地址, Agent地址, 心跳是否未超时)]）并把结果记入 table，
+    返回本轮更新后的状态"""
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(node_id, host, agent_url, alive):
+            async with semaphore:
+                tcp_ms, tls_ms, agent_ms, agent_ok = await probe_node(host, agent_url, tls_port, timeout)
+            return table.record(node_id, tcp_ms, tls_ms, agent_ms, agent_ok, alive)
+
+        return await asyncio.gather(*(probe(*target) for target in targets))
+
+    table.retain([target[0] for target in targets])
+    if not targets:
+        return []
+    return asyncio.run(run())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 数据库结构升级
+在已有数据库上补建新版本增加的表、字段和索引，可重复执行。
+Web容器启动gunicorn之前和Worker启动时执行，多个实例通过分布式锁串行执行
+"""
+
+import logging
+
+from sqlalchemy import inspect
+
+from app import app, db, coordinator, UserAccount
+from bulk import batched
+from subscription import generate_subscription_token
+
+logger = logging.getLogger(__name__)
+
+# 等待其他实例完成升级的最长时间（秒）
+SCHEMA_LOCK_TIMEOUT = 300
+
+# 补填订阅密钥时每批处理的账号数
+BACKFILL_BATCH_SIZE = 1000
+
+def add_missing_columns(engine, table, existing_columns):
+    """为已存在的表补建新增的字段，新增字段均允许为空，不需要默认值"""
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            logger.info(f"添加字段 {table.name}.{column.name}")
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+            )
+
+def backfill_subscription_tokens():
+    """为升级前创建的账号生成订阅密钥，旧的HMAC订阅地址随之失效"""
+    table = UserAccount.__table__
+    total = 0
+    while True:
+        user_ids = db.session.execute(
+            db.select(table.c.id).where(table.c.subscription_token.is_(None)).limit(BACKFILL_BATCH_SIZE)
+        ).scalars().all()
+        if not user_ids:
+            break
+        for batch in batched(user_ids, BACKFILL_BATCH_SIZE):
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('user_id')),
+                [{'user_id': user_id, 'subscription_token': generate_subscription_token()} for user_id in batch]
+            )
+        db.session.commit()
+        total += len(user_ids)
+    if total:
+        logger.info(f"已为 {total} 个账号生成订阅密钥")
+
+def upgrade_schema():
+    """补建缺少的表、字段和索引"""
+    with app.app_context(), coordinator.lock('schema', ttl=SCHEMA_LOCK_TIMEOUT,
+                                             blocking_timeout=SCHEMA_LOCK_TIMEOUT):
+        engine = db.engine
+        existing = set(inspect(engine).get_table_names())
+        missing = [table.name for table in db.metadata.sorted_tables if table.name not in existing]
+        # 只在主库上创建，create_all 跳过已存在的表
+        db.create_all(bind_key=None)
+        if missing:
+            logger.info(f"已创建数据表: {', '.join(missing)}")
+
+        # create_all 不会为已存在的表补建字段和索引（如账号到期调度依赖的 enabled+expire_date 索引）
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {column['name'] for column in inspect(engine).get_columns(table.name)}
+            add_missing_columns(engine, table, columns)
+            if table is UserAccount.__table__:
+                backfill_subscription_tokens()
+            indexes = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    logger.info(f"创建索引 {index.name}，数据量大时可能需要较长时间")
+                    index.create(bind=engine)
+
+if __name__ == '__main__':
+    upgrade_schema()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 用户节点分配
+维护各节点剩余容量的内存索引，按容量、实时负载、健康分数和地区为用户选择节点
+"""
+
+import heapq
+import threading
+from collections import defaultdict
+
+# 负载超过该值的节点不再分配新用户
+MAX_LOAD = 0.9
+
+# 健康分数低于该值的节点不再分配新用户
+MIN_HEALTH = 0.2
+
+class NodeCapacity:
+    """单个节点的容量状态"""
+
+    __slots__ = ('node_id', 'location', 'max_users', 'user_count', 'load', 'health', 'version')
+
+    def __init__(self, node_id, location, max_users, user_count, load=0.0, health=1.0):
+        self.node_id = node_id
+        self.location = location or ''
+        self.max_users = max_users or 0
+        self.user_count = user_count
+        self.load = load or 0.0
+        self.health = 1.0 if health is None else health
+        self.version = 0
+
+    @property
+    def free(self):
+        return self.max_users - self.user_count
+
+    @property
+    def utilization(self):
+        if self.max_users <= 0:
+            return 1.0
+        return self.user_count / self.max_users
+
+    @property
+    def available(self):
+        """是否可以分配新用户"""
+        return self.free > 0 and self.load < MAX_LOAD and self.health >= MIN_HEALTH
+
+    def score(self):
+        """分数越高越优先，兼顾剩余容量比例、实时负载和探测得到的健康分数"""
+        if self.max_users <= 0:
+            return 0.0
+        return (self.free / self.max_users) * (1.0 - min(self.load, 1.0)) * self.health
+
+    def to_dict(self):
+        return {
+            'node_id': self.node_id,
+            'location': self.location,
+            'max_users': self.max_users,
+            'user_count': self.user_count,
+            'free': self.free,
+            'load': round(self.load, 3),
+            'health': round(self.health, 3),
+        }
+
+class PlacementIndex:
+    """节点剩余容量索引
+
+    每个地区维护一个按分数排序的最大堆，节点状态变化时压入新条目并递增版本号，
+    旧条目在弹出时按版本号惰性丢弃，因此单次分配为 O(log n)。
+    """
+
+    def __init__(self, nodes=()):
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._heaps = defaultdict(list)
+        for node in nodes:
+            self._add(node)
+
+    def _push(self, node):
+        node.version += 1
+        if node.available:
+            entry = (-node.score(), node.version, node.node_id)
+            heapq.heappush(self._heaps[node.location], entry)
+            heapq.heappush(self._heaps[None], entry)
+            if len(self._heaps[None]) > 4 * len(self._nodes) + 64:
+                self._compact()
+
+    def _compact(self):
+        """丢弃所有过期条目，防止频繁更新负载时堆无限增长"""
+        self._heaps = defaultdict(list)
+        for node in self._nodes.values():
+            if node.available:
+                entry = (-node.score(), node.version, node.node_id)
+                self._heaps[node.location].append(entry)
+                self._heaps[None].append(entry)
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+
+    def _add(self, node):
+        self._nodes[node.node_id] = node
+        self._push(node)
+
+    def _pop_best(self, location):
+        heap = self._heaps.get(location)
+        while heap:
+            _, version, node_id = heap[0]
+            node = self._nodes.get(node_id)
+            if node is None or node.version != version:
+                heapq.heappop(heap)
+                continue
+            return node
+        return None
+
+    def update_node(self, node_id, location, max_users, user_count=None, load=None):
+        """新增或更新节点的配置"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None:
+                self._add(NodeCapacity(node_id, location, max_users, user_count or 0, load))
+                return
+            if location is not None:
+                node.location = location
+            node.max_users = max_users or 0
+            if user_count is not None:
+                node.user_count = user_count
+            if load is not None:
+                node.load = load
+            self._push(node)
+
+    def update_load(self, node_id, load):
+        """心跳上报后更新节点负载"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is not None:
+                node.load = load
+                self._push(node)
+
+    def update_health(self, node_id, health):
+        """健康探测后更新节点健康分数"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is not None:
+                node.health = health
+                self._push(node)
+
+    def remove_node(self, node_id):
+        """节点删除或下线后移出索引"""
+        with self._lock:
+            self._nodes.pop(node_id, None)
+
+    def place(self, location=None):
+        """为一个新用户选择节点，返回节点ID；无可用容量时返回None
+
+        指定地区时只在该地区内选择。
+        """
+        with self._lock:
+            node = self._pop_best(location)
+            if node is None:
+                return None
+            node.user_count += 1
+            self._push(node)
+            return node.node_id
+
+    def release(self, node_id):
+        """用户移出节点后归还容量"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is not None and node.user_count > 0:
+                node.user_count -= 1
+                self._push(node)
+
+    def plan_rebalance(self, location=None, tolerance=0.1):
+        """规划用户迁移，使同一地区内各节点的使用率差距不超过 tolerance
+
+        返回 {(源节点ID, 目标节点ID): 迁移人数}，并同步更新索引中的计数。
+        """
+        with self._lock:
+            groups = defaultdict(list)
+            for node in self._nodes.values():
+                if location is None or node.location == location:
+                    groups[node.location].append(node)
+
+            moves = defaultdict(int)
+            for nodes in groups.values():
+                # 以平均使用率为界划分迁出和迁入节点，每个节点只会单向变化
+                total_users = sum(n.user_count for n in nodes)
+                total_capacity = sum(n.max_users for n in nodes if n.max_users > 0)
+                if total_capacity <= 0:
+                    continue
+                mean = total_users / total_capacity
+
+                sources = [(-n.utilization, n.node_id) for n in nodes if n.utilization > mean and n.user_count > 0]
+                targets = [(n.utilization, n.node_id) for n in nodes
+                           if n.utilization < mean and n.available]
+                heapq.heapify(sources)
+                heapq.heapify(targets)
+
+                while sources and targets:
+                    source = self._nodes[sources[0][1]]
+                    target = self._nodes[targets[0][1]]
+                    if source.utilization - target.utilization <= tolerance:
+                        break
+
+                    source.user_count -= 1
+                    target.user_count += 1
+                    moves[(source.node_id, target.node_id)] += 1
+
+                    if source.utilization > mean and source.user_count > 0:
+                        heapq.heapreplace(sources, (-source.utilization, source.node_id))
+                    else:
+                        heapq.heappop(sources)
+                    if target.utilization < mean and target.free > 0:
+                        heapq.heapreplace(targets, (target.utilization, target.node_id))
+                    else:
+                        heapq.heappop(targets)
+
+                for node in nodes:
+                    self._push(node)
+
+            return dict(moves)
+
+    def snapshot(self):
+        """返回所有节点的容量状态"""
+        with self._lock:
+            return [node.to_dict() for node in sorted(self._nodes.values(), key=lambda n: n.node_id)]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 限流与准入控制
+按来源IP和节点的令牌桶限流，以及全局并发请求数限制。配置Redis时多个worker和副本共享计数，
+未配置时退化为进程内实现
+"""
+
+import logging
+import secrets
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶：按经过的时间补充令牌，不足时返回需要等待的秒数。使用Redis服务器时间，各副本时钟不一致也不影响
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+# 并发许可：有序集合中每个进行中的请求一个成员，超时未释放的（worker被杀死等）按时间清理
+ACQUIRE_SLOT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+# 键前缀
+RATE_LIMIT_PREFIX = 'ratelimit'
+
+# 并发许可的键
+INFLIGHT_KEY = 'admission:inflight'
+
+# 并发许可的最长持有时间（秒），与gunicorn的请求超时一致
+SLOT_TTL = 120
+
+# 进程内令牌桶数量超过该值时清理已补满的桶
+MAX_LOCAL_BUCKETS = 10000
+
+def parse_rate(value):
+    """解析 "次数/秒数" 格式的限流配置，返回 (桶容量, 每秒补充的令牌数)"""
+    count, _, period = str(value).partition('/')
+    count, period = int(count), float(period or 1)
+    if count <= 0 or period <= 0:
+        raise ValueError(f"invalid rate: {value}")
+    return count, count / period
+
+class RateLimiter:
+    """令牌桶限流
+
+    Redis不可用时放行请求，限流不应使正常节点无法上报。
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT) if redis_client is not None else None
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def hit(self, key, capacity, rate):
+        """消耗一个令牌，允许时返回0，否则返回需等待的秒数"""
+        if self.redis is None:
+            return self._hit_local(key, capacity, rate)
+        try:
+            return float(self._script(keys=[f"{RATE_LIMIT_PREFIX}:{key}"], args=[capacity, rate]))
+        except redis.RedisError as e:
+            logger.warning(f"限流计数失败: {e}")
+            return 0
+
+    def _hit_local(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        for key, (tokens, ts) in list(self._buckets.items()):
+            if now - ts > 3600 or tokens >= 1 and now - ts > 60:
+                del self._buckets[key]
+
+class ConcurrencyLimiter:
+    """全局并发请求数限制
+
+    超过 limit 个请求正在处理时拒绝新请求，在数据库连接耗尽之前削减负载。
+    acquire() 返回许可，请求结束后必须调用 release()；limit 不大于0时不限制。
+    """
+
+    def __init__(self, redis_client=None, limit=0, key=INFLIGHT_KEY, ttl=SLOT_TTL):
+        self.redis = redis_client
+        self.limit = limit
+        self.key = key
+        self.ttl = ttl
+        self._script = redis_client.register_script(ACQUIRE_SLOT_SCRIPT) if redis_client is not None else None
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+    def acquire(self):
+        """获取许可，超过限制时返回None"""
+        if self.limit <= 0:
+            return True
+        if self.redis is None:
+            with self._lock:
+                if self._inflight >= self.limit:
+                    return None
+                self._inflight += 1
+                return True
+
+        token = secrets.token_hex(8)
+        try:
+            if not self._script(keys=[self.key], args=[self.limit, self.ttl, token]):
+                return None
+        except redis.RedisError as e:
+            logger.warning(f"获取并发许可失败: {e}")
+            return True
+        return token
+
+    def release(self, permit):
+        if permit is None or self.limit <= 0:
+            return
+        if self.redis is None:
+            with self._lock:
+                self._inflight -= 1
+            return
+        if permit is True:
+            return
+        try:
+            self.redis.zrem(self.key, permit)
+        except redis.RedisError as e:
+            logger.warning(f"释放并发许可失败: {e}")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 订阅链接生成与缓存
+根据用户账号和节点协议生成分享链接，预计算压缩后的订阅内容并缓存
+"""
+
+import base64
+import gzip
+import hashlib
+import logging
+import secrets
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# 缓存键前缀
+CACHE_PREFIX = 'sub'
+
+# 缓存过期时间（秒），兼作失效通知丢失时的兜底及已用流量的刷新周期
+CACHE_TTL = 3600
+
+# 客户端自动更新间隔（小时）
+PROFILE_UPDATE_INTERVAL = 6
+
+def generate_subscription_token():
+    """生成随机的订阅密钥，每个账号一个，重置后旧订阅地址立即失效"""
+    return secrets.token_urlsafe(24)
+
+def build_share_links(user, node, hidden_path):
+    """生成用户在节点上所有已启用协议的分享链接"""
+    links = []
+    host = node.server_ip
+    remark = quote(f"{node.name}-{user.username}")
+
+    if node.enable_vless:
+        params = {
+            'encryption': 'none',
+            'security': 'tls',
+            'sni': host,
+            'type': 'tcp',
+            'flow': 'xtls-rprx-vision',
+        }
+        links.append(f"vless://{user.password}@{host}:443?{urlencode(params)}#{remark}-vless")
+
+    if node.enable_splithttp:
+        params = {
+            'encryption': 'none',
+            'security': 'tls',
+            'sni': host,
+            'type': 'splithttp',
+            'path': f"/{hidden_path}",
+        }
+        links.append(f"vless://{user.password}@{host}:443?{urlencode(params)}#{remark}-splithttp")
+
+    if node.enable_hysteria2:
+        params = {'sni': host}
+        links.append(f"hysteria2://{quote(user.password, safe='')}@{host}:443?{urlencode(params)}#{remark}-hysteria2")
+
+    return links
+
+def build_userinfo(user):
+    """生成 Subscription-Userinfo 头，供客户端显示流量和到期时间"""
+    parts = [
+        'upload=0',
+        f"download={user.used_data or 0}",
+        f"total={user.data_limit or 0}",
+    ]
+    if user.expire_date:
+        parts.append(f"expire={int(user.expire_date.timestamp())}")
+    return '; '.join(parts)
+
+def encode_subscription(links):
+    """编码为通用的 base64 订阅格式"""
+    return base64.b64encode('\n'.join(links).encode()).decode()
+
+class SubscriptionCache:
+    """订阅内容缓存
+
+    每个用户缓存一份gzip压缩后的订阅内容和ETag。用户和节点各有一个代数计数器，
+    变更时只需递增计数器即可使相关缓存失效，节点变更无需逐个删除其下用户的缓存。
+    代数需在读取数据库之前获取，避免并发修改时写入过期内容。
+    未配置Redis时退化为进程内字典。
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self._local = {}
+        self._local_generations = {}
+
+    def _entry_key(self, user_id):
+        return f"{CACHE_PREFIX}:user:{user_id}"
+
+    def _gen_key(self, kind, object_id):
+        return f"{CACHE_PREFIX}:{kind}_gen:{object_id}"
+
+    def _generations(self, keys):
+        if self.redis is None:
+            return [self._local_generations.get(key, 0) for key in keys]
+        return [int(value or 0) for value in self.redis.mget(keys)]
+
+    def generation(self, kind, object_id):
+        """读取用户（kind='user'）或节点（kind='node'）的当前代数"""
+        if object_id is None:
+            return 0
+        return self._generations([self._gen_key(kind, object_id)])[0]
+
+    def get(self, user_id):
+        """读取缓存，任一代数不匹配时视为未命中"""
+        try:
+            if self.redis is None:
+                entry = self._local.get(user_id)
+                if entry and entry['expires_at'] <= time.time():
+                    entry = None
+            else:
+                raw = self.redis.hgetall(self._entry_key(user_id))
+                entry = None
+                # 升级前写入的缓存没有订阅密钥，视为未命中
+                if raw and b'token' in raw:
+                    entry = {k.decode(): v for k, v in raw.items()}
+                    entry['node_id'] = int(entry['node_id']) if entry['node_id'] else None
+                    entry['user_gen'] = int(entry['user_gen'])
+                    entry['node_gen'] = int(entry['node_gen'])
+                    entry['etag'] = entry['etag'].decode()
+                    entry['token'] = entry['token'].decode()
+                    entry['userinfo'] = entry['userinfo'].decode()
+            if not entry:
+                return None
+
+            keys = [self._gen_key('user', user_id)]
+            if entry['node_id'] is not None:
+                keys.append(self._gen_key('node', entry['node_id']))
+            current = self._generations(keys) + [0]
+            if entry['user_gen'] != current[0] or entry['node_gen'] != current[1]:
+                return None
+            return entry
+        except redis.RedisError as e:
+            logger.warning(f"读取订阅缓存失败: {e}")
+            return None
+
+    def put(self, user, node, links, user_gen, node_gen):
+        """写入预计算的订阅内容，user_gen/node_gen 为读取数据库前获取的代数"""
+        body = encode_subscription(links).encode()
+
+        # 账号到期时缓存同时过期，保证到期后不再下发链接
+        ttl = CACHE_TTL
+        if user.expire_date:
+            remaining = (user.expire_date - datetime.utcnow()).total_seconds()
+            ttl = max(1, min(ttl, int(remaining) + 1))
+
+        entry = {
+            'token': user.subscription_token or '',
+            'node_id': node.id if node else None,
+            'user_gen': user_gen,
+            'node_gen': node_gen,
+            'etag': hashlib.sha256(body).hexdigest()[:32],
+            'userinfo': build_userinfo(user),
+            'body': gzip.compress(body),
+        }
+
+        if self.redis is None:
+            self._local[user.id] = dict(entry, expires_at=time.time() + ttl)
+            return entry
+
+        try:
+            mapping = dict(entry, node_id='' if node is None else node.id)
+            pipe = self.redis.pipeline()
+            pipe.hset(self._entry_key(user.id), mapping=mapping)
+            pipe.expire(self._entry_key(user.id), ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入订阅缓存失败: {e}")
+        return entry
+
+    def invalidate(self, user_ids=(), node_ids=()):
+        """用户或节点变更后递增其代数"""
+        keys = [self._gen_key('user', i) for i in user_ids] + [self._gen_key('node', i) for i in node_ids]
+        if not keys:
+            return
+        if self.redis is None:
+            for key in keys:
+                self._local_generations[key] = self._local_generations.get(key, 0) + 1
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for key in keys:
+                pipe.incr(key)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"更新订阅缓存代数失败: {e}")
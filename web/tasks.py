@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 后台任务队列
+基于Redis的任务队列，支持失败重试、按键去重和任务状态查询
+"""
+
+import json
+import logging
+import secrets
+import socket
+import threading
+import time
+import uuid
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# 键前缀
+QUEUE_PREFIX = 'jobs'
+
+# 完成或失败的任务状态保留时间（秒）
+RESULT_TTL = 24 * 3600
+
+# 重试退避基数（秒），第n次重试等待 base * 2^(n-1)
+RETRY_BACKOFF = 10
+
+# Worker心跳的过期时间（秒），超过此时间没有心跳的Worker视为已停止，其执行中的任务重新入队
+WORKER_TTL = 30
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_RETRYING = 'retrying'
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+
+class TaskQueue:
+    """任务队列
+
+    任务参数和状态保存在 jobs:job:<id> 哈希中，待执行任务ID在 jobs:queue 列表中，
+    等待重试的任务在 jobs:delayed 有序集合中按执行时间排序。
+    每个Worker进程有自己的执行中列表和心跳键，容器重建后主机名和ID都会变化，
+    因此由存活的Worker回收没有心跳的Worker遗留的执行中任务。
+    指定 dedup_key 时同一个键同时只有一个排队中的任务，任务开始执行后即可再次入队。
+    未配置Redis时任务在入队时同步执行，仅用于本地开发。
+    """
+
+    def __init__(self, redis_client=None, worker_id=None):
+        self.redis = redis_client
+        self.worker_id = worker_id or f"{socket.gethostname()}-{secrets.token_hex(4)}"
+        self.handlers = {}
+        self._local_jobs = {}
+        self._heartbeat = None
+
+    def task(self, name):
+        """注册任务处理函数"""
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+        return decorator
+
+    # 键名
+    def _job_key(self, job_id):
+        return f"{QUEUE_PREFIX}:job:{job_id}"
+
+    def _dedup_key(self, key):
+        return f"{QUEUE_PREFIX}:dedup:{key}"
+
+    @property
+    def _queue_key(self):
+        return f"{QUEUE_PREFIX}:queue"
+
+    def _processing_key_of(self, worker_id):
+        return f"{QUEUE_PREFIX}:processing:{worker_id}"
+
+    @property
+    def _processing_key(self):
+        # 每个Worker一个执行中列表
+        return self._processing_key_of(self.worker_id)
+
+    def _worker_key(self, worker_id):
+        return f"{QUEUE_PREFIX}:worker:{worker_id}"
+
+    @property
+    def _delayed_key(self):
+        return f"{QUEUE_PREFIX}:delayed"
+
+    # 入队
+    def enqueue(self, name, args=None, dedup_key=None, max_retries=3):
+        """提交任务，返回任务ID；去重键已有排队中的任务时返回该任务ID"""
+        if name not in self.handlers:
+            raise ValueError(f"Unknown task: {name}")
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'task': name,
+            'args': json.dumps(args or {}),
+            'status': STATUS_QUEUED,
+            'attempts': 0,
+            'max_retries': max_retries,
+            'dedup_key': dedup_key or '',
+            'error': '',
+            'result': '',
+            'created_at': time.time(),
+            'updated_at': time.time(),
+        }
+
+        if self.redis is None:
+            self._local_jobs[job_id] = job
+            self._run(job)
+            return job_id
+
+        if dedup_key:
+            existing = self.redis.set(self._dedup_key(dedup_key), job_id, nx=True, get=True, ex=RESULT_TTL)
+            if existing is not None:
+                return existing.decode()
+
+        pipe = self.redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping=job)
+        pipe.lpush(self._queue_key, job_id)
+        pipe.execute()
+        return job_id
+
+    def get_status(self, job_id):
+        """查询任务状态，不存在时返回None"""
+        if self.redis is None:
+            job = self._local_jobs.get(job_id)
+        else:
+            raw = self.redis.hgetall(self._job_key(job_id))
+            job = {k.decode(): v.decode() for k, v in raw.items()} if raw else None
+        if not job:
+            return None
+
+        return {
+            'id': job['id'],
+            'task': job['task'],
+            'status': job['status'],
+            'attempts': int(job['attempts']),
+            'max_retries': int(job['max_retries']),
+            'error': job['error'] or None,
+            'result': json.loads(job['result']) if job['result'] else None,
+            'created_at': float(job['created_at']),
+            'updated_at': float(job['updated_at']),
+        }
+
+    # 执行
+    def _update(self, job, **fields):
+        job.update(fields, updated_at=time.time())
+        if self.redis is not None:
+            self.redis.hset(self._job_key(job['id']), mapping=dict(fields, updated_at=job['updated_at']))
+
+    def _run(self, job):
+        """执行一次任务，返回是否需要重试"""
+        handler = self.handlers.get(job['task'])
+        attempts = int(job['attempts']) + 1
+        self._update(job, status=STATUS_RUNNING, attempts=attempts)
+
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown task: {job['task']}")
+            result = handler(**json.loads(job['args']))
+        except Exception as e:
+            logger.error(f"任务执行失败 {job['task']} ({job['id']}): {e}")
+            if self.redis is not None and attempts <= int(job['max_retries']):
+                self._update(job, status=STATUS_RETRYING, error=str(e))
+                return True
+            self._update(job, status=STATUS_FAILED, error=str(e))
+            return False
+
+        self._update(job, status=STATUS_FINISHED, error='', result=json.dumps(result))
+        return False
+
+    def _promote_delayed(self):
+        """把到期的重试任务移回队列"""
+        now = time.time()
+        for job_id in self.redis.zrangebyscore(self._delayed_key, 0, now):
+            if self.redis.zrem(self._delayed_key, job_id):
+                self.redis.lpush(self._queue_key, job_id)
+
+    def heartbeat(self):
+        """刷新本Worker的心跳"""
+        self.redis.set(self._worker_key(self.worker_id), int(time.time()), ex=WORKER_TTL)
+
+    def start_heartbeat(self):
+        """启动后台心跳线程，任务执行时间超过 WORKER_TTL 时也不会被其他Worker回收"""
+        if self._heartbeat is not None:
+            return
+
+        def beat():
+            while True:
+                try:
+                    self.heartbeat()
+                except redis.RedisError as e:
+                    logger.error(f"Worker心跳失败: {e}")
+                time.sleep(WORKER_TTL / 3)
+
+        self.heartbeat()
+        self._heartbeat = threading.Thread(target=beat, name='task-worker-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def requeue_orphans(self):
+        """把已停止（没有心跳）的Worker遗留的执行中任务重新入队，返回任务数"""
+        prefix = self._processing_key_of('')
+        requeued = 0
+        for key in self.redis.scan_iter(match=f"{prefix}*"):
+            worker_id = key.decode()[len(prefix):]
+            if worker_id == self.worker_id or self.redis.exists(self._worker_key(worker_id)):
+                continue
+            while self.redis.lmove(key, self._queue_key, 'RIGHT', 'LEFT'):
+                requeued += 1
+        if requeued:
+            logger.warning(f"重新入队 {requeued} 个已停止Worker遗留的任务")
+        return requeued
+
+    def work_once(self, timeout=5):
+        """取出并执行一个任务，队列为空时等待最多 timeout 秒"""
+        self._promote_delayed()
+        job_id = self.redis.blmove(self._queue_key, self._processing_key, timeout, 'RIGHT', 'LEFT')
+        if job_id is None:
+            return False
+
+        raw = self.redis.hgetall(self._job_key(job_id.decode()))
+        if not raw:
+            self.redis.lrem(self._processing_key, 1, job_id)
+            return True
+        job = {k.decode(): v.decode() for k, v in raw.items()}
+
+        # 开始执行后释放去重键，执行期间的新变更可以再次入队
+        if job['dedup_key']:
+            self.redis.delete(self._dedup_key(job['dedup_key']))
+
+        retry = self._run(job)
+
+        pipe = self.redis.pipeline()
+        if retry:
+            delay = RETRY_BACKOFF * 2 ** (int(job['attempts']) - 1)
+            pipe.zadd(self._delayed_key, {job['id']: time.time() + delay})
+        else:
+            pipe.expire(self._job_key(job['id']), RESULT_TTL)
+        pipe.lrem(self._processing_key, 1, job_id)
+        pipe.execute()
+        return True
+
+    def run_worker(self, app=None):
+        """持续执行任务，app 为Flask应用时在应用上下文中执行"""
+        if self.redis is None:
+            raise RuntimeError('REDIS_URL is required to run the worker')
+
+        logger.info(f"任务Worker启动: {self.worker_id}")
+        self.start_heartbeat()
+        next_reclaim = 0
+        while True:
+            try:
+                if time.monotonic() >= next_reclaim:
+                    self.requeue_orphans()
+                    next_reclaim = time.monotonic() + WORKER_TTL
+                if app is not None:
+                    with app.app_context():
+                        self.work_once()
+                else:
+                    self.work_once()
+            except redis.RedisError as e:
+                logger.error(f"任务队列连接失败: {e}")
+                time.sleep(5)
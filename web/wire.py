@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - Agent上报数据的编码
+Master在注册和心跳响应中声明支持的编码，Agent据此选择msgpack序列化、zstd压缩
+以及省略未变化统计字段的增量心跳；未安装对应依赖时退回JSON和gzip
+"""
+
+import io
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+# Master可接收的编码，delta 表示心跳可省略与上次确认时相同的统计字段
+SUPPORTED_ENCODINGS = [
+    name for name, available in (
+        ('msgpack', msgpack is not None),
+        ('zstd', zstandard is not None),
+        ('delta', True),
+    ) if available
+]
+
+def decompress(body, content_encoding, max_size):
+    """按 Content-Encoding 解压请求体，超过 max_size 或格式错误时抛出 ValueError"""
+    if not content_encoding or content_encoding == 'identity':
+        return body
+
+    if content_encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(body, max_size)
+        except zlib.error as e:
+            raise ValueError(f"invalid gzip body: {e}") from None
+        if decompressor.unconsumed_tail:
+            raise ValueError('body too large')
+        return data
+
+    if content_encoding == 'zstd' and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                data = reader.read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"invalid zstd body: {e}") from None
+        if len(data) > max_size:
+            raise ValueError('body too large')
+        return data
+
+    raise ValueError(f"unsupported encoding: {content_encoding}")
+
+def decode_body(body, content_type, content_encoding, max_size):
+    """解码Agent上报的请求体，返回对象，失败时抛出 ValueError"""
+    data = decompress(body, content_encoding, max_size)
+    if content_type == MSGPACK_CONTENT_TYPE:
+        if msgpack is None:
+            raise ValueError('msgpack is not supported')
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (msgpack.UnpackException, ValueError, TypeError) as e:
+            raise ValueError(f"invalid msgpack body: {e}") from None
+    return json.loads(data)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Xray集群管理 - 后台任务Worker
+执行配置推送、节点重启等耗时任务，避免占用Web请求进程；
+同时参与主节点选举，由主节点执行周期任务和账号到期调度
+"""
+
+import threading
+
+from app import (app, task_queue, coordinator, PERIODIC_TASKS,
+                 disable_expired_users, next_user_expiry)
+from expiry import ExpiryScheduler
+from migrate import upgrade_schema
+
+if __name__ == '__main__':
+    upgrade_schema()
+    
+    election = coordinator.leader('scheduler')
+    scheduler = threading.Thread(
+        target=election.run_periodic,
+        args=(PERIODIC_TASKS, app),
+        daemon=True
+    )
+    scheduler.start()
+
+    expiry = ExpiryScheduler(
+        disable_expired_users,
+        next_user_expiry,
+        is_leader=lambda: election.is_leader,
+        app=app
+    )
+    threading.Thread(target=expiry.run, daemon=True).start()
+    
+    task_queue.run_worker(app)